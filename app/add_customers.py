@@ -6,9 +6,19 @@ from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from collections import defaultdict
+import argparse
 import asyncio
-from datetime import datetime
-from app.models import Customer
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from app.database import missing_indexes
+from app.models import Customer, IngestionCheckpoint
+from app.redis_client import get_redis
+from app.latest_price import refresh_latest_price
+from app.live_updates import PRICE_CHANNEL, customer_channel, publish
+from app.range_cache import invalidate_all_blocks, customer_series, price_series
+from app.http_cache import bump_data_version, sipx_prices_version_key, customer_data_version_key
+from app.ingestion import read_columns, customer_column_groups, parse_prices, parse_customer_group
+from app.packed_series import PACKED_STORAGE, HOURS_PER_BLOCK, pack_rows, merge_packed_blocks
 
 # Load environment variables
 load_dotenv()
@@ -20,18 +30,24 @@ engine = create_async_engine(DATABASE_URL, echo=True, future=True)
 # Create sessionmaker for async sessions
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
-# Load CSV (adjust path if necessary based on Docker file location)
-df = pd.read_csv("data.csv", sep=",")  # Ensure the file is available inside Docker
+# CSV file to load (adjust path if necessary based on Docker file location)
+DATA_FILE = "data.csv"  # Ensure the file is available inside Docker
+
+# rows already ingested are re-read for this long so late corrections are picked up
+INCREMENTAL_LOOKBACK = timedelta(hours=48)
+# rows written per statement in incremental mode
+UPSERT_BATCH_SIZE = 5000
 
 # Function to truncate all tables (async version)
 async def truncate_tables(engine):
   async with engine.begin() as conn:
     await conn.execute(text("TRUNCATE TABLE consumption_production RESTART IDENTITY CASCADE;"))
+    await conn.execute(text("TRUNCATE TABLE consumption_production_blocks RESTART IDENTITY CASCADE;"))
     await conn.execute(text("TRUNCATE TABLE sipx_prices RESTART IDENTITY CASCADE;"))
     await conn.execute(text("TRUNCATE TABLE customers RESTART IDENTITY CASCADE;"))
 
 # Async function to insert SIPX prices
-async def insert_sipx_prices():
+async def insert_sipx_prices(df):
   df_renamed = df.rename(columns={
     "timestamp_utc": "timestamp",  # Change 'timestamp_utc' to 'timestamp'
     "SIPX_EUR_kWh": "price_EUR_kWh"  # Change 'SIPX_EUR_kWh' to 'price_EUR_kWh'
@@ -50,10 +66,24 @@ async def insert_sipx_prices():
         )
     await session.commit()  # Ensure commit after all insertions
 
+  await announce_prices_loaded()
+
+# Updates the latest price pointer and caches after prices were loaded
+async def announce_prices_loaded():
+  # point the latest price at the newest imported entry
+  async with async_session() as session:
+    latest_entry = await refresh_latest_price(get_redis(), session)
+
+  bump_data_version(get_redis(), sipx_prices_version_key())
+
+  # tell live subscribers about the new latest price
+  if latest_entry:
+    publish(get_redis(), PRICE_CHANNEL, {"type": "sipx_price", "data": latest_entry.to_dict()})
+
 # Async function to insert customer data
-async def insert_customers():
+async def insert_customers(columns):
   customer_roles = {}
-  for col in df.columns:
+  for col in columns:
     if col.startswith("customer"):
       parts = col.split("_")
       customer_name, data_type = parts[0], parts[1]
@@ -88,7 +118,7 @@ async def get_customer_ids():
     return {row.name: row.id for row in result.all()}
 
 # Async function to insert production/consumption data
-async def insert_prod_cons_data():
+async def insert_prod_cons_data(df):
   customer_map = await get_customer_ids()
 
   combined_data = defaultdict(lambda: {"consumption_kWh": None, "production_kWh": None})
@@ -120,23 +150,196 @@ async def insert_prod_cons_data():
     for key, values in combined_data.items()
   ]
 
+  if PACKED_STORAGE:
+    await merge_blocks_in_batches(prod_cons_data, 1)
+  else:
+    async with async_session() as session:
+      async with session.begin():
+        for data in prod_cons_data:
+          await session.execute(
+            text("""
+                INSERT INTO consumption_production ("timestamp", "customer_id", "consumption_kWh", "production_kWh")
+                VALUES (:timestamp, :customer_id, :consumption_kWh, :production_kWh)
+            """),
+            data
+            )
+
+  announce_customer_data_loaded(prod_cons_data)
+
+# Bumps data versions and notifies live subscribers, returns the loaded range per customer
+def announce_customer_data_loaded(prod_cons_data):
+  # one message per customer instead of one per row, subscribers refetch the loaded range
+  loaded_ranges = defaultdict(list)
+  for data in prod_cons_data:
+    loaded_ranges[data["customer_id"]].append(data["timestamp"])
+  for customer_id, timestamps in loaded_ranges.items():
+    bump_data_version(get_redis(), customer_data_version_key(customer_id))
+    publish(get_redis(), customer_channel(customer_id), {
+      "type": "bulk_load",
+      "customer_id": customer_id,
+      "start": min(timestamps),
+      "end": max(timestamps)
+    })
+  return {customer_id: (min(timestamps), max(timestamps)) for customer_id, timestamps in loaded_ranges.items()}
+
+# Async function to read the last ingested timestamp of a source file
+async def get_checkpoint(source):
+  async with async_session() as session:
+    result = await session.execute(select(IngestionCheckpoint).filter(IngestionCheckpoint.source == source))
+    checkpoint = result.scalars().first()
+    return checkpoint.last_timestamp if checkpoint else None
+
+# Async function to store the last ingested timestamp of a source file
+async def set_checkpoint(source, last_timestamp):
   async with async_session() as session:
     async with session.begin():
-      for data in prod_cons_data:
-        await session.execute(
-          text("""
-              INSERT INTO consumption_production ("timestamp", "customer_id", "consumption_kWh", "production_kWh")
-              VALUES (:timestamp, :customer_id, :consumption_kWh, :production_kWh)
-          """),
-          data
-          )
+      await session.execute(
+        text("""
+          INSERT INTO ingestion_checkpoints (source, last_timestamp)
+          VALUES (:source, :last_timestamp)
+          ON CONFLICT (source) DO UPDATE
+          SET last_timestamp = EXCLUDED.last_timestamp;
+        """),
+        {"source": source, "last_timestamp": last_timestamp}
+      )
 
-# Main async function to execute all tasks
-async def main():
+# Async function to run write(session, batch) over several concurrent connections, one transaction per batch
+async def write_in_batches(write, items, writers, batch_size=UPSERT_BATCH_SIZE):
+  semaphore = asyncio.Semaphore(writers)
+
+  async def write_batch(batch):
+    async with semaphore:
+      async with async_session() as session:
+        async with session.begin():
+          await write(session, batch)
+
+  await asyncio.gather(*(
+    write_batch(items[i:i + batch_size]) for i in range(0, len(items), batch_size)
+  ))
+
+# Async function to write rows in batches over several concurrent connections
+async def upsert_in_batches(statement, rows, writers):
+  await write_in_batches(lambda session, batch: session.execute(statement, batch), rows, writers)
+
+# Async function to merge rows into packed day blocks, batches never split a block
+async def merge_blocks_in_batches(rows, writers):
+  await write_in_batches(merge_packed_blocks, pack_rows(rows), writers, UPSERT_BATCH_SIZE // HOURS_PER_BLOCK)
+
+# only rows whose values differ are rewritten, so re-reading the lookback window is cheap
+UPSERT_SIPX_PRICES = text("""
+  INSERT INTO sipx_prices ("timestamp", "price_EUR_kWh")
+  VALUES (:timestamp, :price_EUR_kWh)
+  ON CONFLICT ("timestamp") DO UPDATE
+  SET "price_EUR_kWh" = EXCLUDED."price_EUR_kWh"
+  WHERE sipx_prices."price_EUR_kWh" IS DISTINCT FROM EXCLUDED."price_EUR_kWh";
+""")
+
+UPSERT_PROD_CONS_DATA = text("""
+  INSERT INTO consumption_production ("timestamp", "customer_id", "consumption_kWh", "production_kWh")
+  VALUES (:timestamp, :customer_id, :consumption_kWh, :production_kWh)
+  ON CONFLICT ("customer_id", "timestamp") DO UPDATE
+  SET "consumption_kWh" = EXCLUDED."consumption_kWh",
+      "production_kWh" = EXCLUDED."production_kWh"
+  WHERE consumption_production."consumption_kWh" IS DISTINCT FROM EXCLUDED."consumption_kWh"
+     OR consumption_production."production_kWh" IS DISTINCT FROM EXCLUDED."production_kWh";
+""")
+
+# Loads only rows newer than the checkpoint, without truncating, so reads are never interrupted.
+# The checkpoint moves only after every batch is committed and upserts are idempotent,
+# so a crashed run can simply be started again.
+async def ingest_incremental(path, parsers, writers):
+  source = os.path.basename(path)
+  checkpoint = await get_checkpoint(source)
+  since = checkpoint - INCREMENTAL_LOOKBACK if checkpoint else None
+
+  columns = read_columns(path)
+  await insert_customers(columns)
+  customer_map = await get_customer_ids()
+
+  # parse price and customer column groups in separate processes
+  loop = asyncio.get_running_loop()
+  with ProcessPoolExecutor(max_workers=parsers) as pool:
+    prices, *customer_groups = await asyncio.gather(
+      loop.run_in_executor(pool, parse_prices, path, since),
+      *(
+        loop.run_in_executor(pool, parse_customer_group, path, group, since)
+        for group in customer_column_groups(columns, parsers)
+      )
+    )
+
+  prod_cons_data = [
+    {
+      "timestamp": row["timestamp"],
+      "customer_id": customer_map[row["customer_name"]],
+      "consumption_kWh": row["consumption_kWh"],
+      "production_kWh": row["production_kWh"],
+    }
+    for group in customer_groups for row in group
+    if row["customer_name"] in customer_map
+  ]
+
+  await upsert_in_batches(UPSERT_SIPX_PRICES, prices, writers)
+  if PACKED_STORAGE:
+    await merge_blocks_in_batches(prod_cons_data, writers)
+  else:
+    await upsert_in_batches(UPSERT_PROD_CONS_DATA, prod_cons_data, writers)
+
+  # drop only the cached blocks the load touched
+  redis = get_redis()
+  if prices:
+    timestamps = [price["timestamp"] for price in prices]
+    price_series.invalidate_range(redis, min(timestamps), max(timestamps))
+    await announce_prices_loaded()
+  loaded_ranges = announce_customer_data_loaded(prod_cons_data)
+  for customer_id, (start, end) in loaded_ranges.items():
+    customer_series(customer_id).invalidate_range(redis, start, end)
+
+  timestamps = [price["timestamp"] for price in prices] + [data["timestamp"] for data in prod_cons_data]
+  if timestamps:
+    await set_checkpoint(source, max(timestamps))
+
+# Reloads everything from scratch
+async def ingest_full(path):
+  df = pd.read_csv(path, sep=",")
   await truncate_tables(engine)
-  await insert_sipx_prices()
-  await insert_customers()
-  await insert_prod_cons_data()
+  await insert_sipx_prices(df)
+  await insert_customers(df.columns)
+  await insert_prod_cons_data(df)
+  invalidate_all_blocks(get_redis())
+  await set_checkpoint(os.path.basename(path), pd.to_datetime(df["timestamp_utc"], utc=True).max().to_pydatetime())
+
+# keeps only the newest row of each key that blocks a missing unique index, the API refuses to start until they are gone
+def delete_duplicates(sync_conn):
+  for index in missing_indexes(sync_conn):
+    if not index.unique:
+      continue
+    matches = " AND ".join(f'newer."{column.name}" = older."{column.name}"' for column in index.columns)
+    result = sync_conn.execute(text(
+      f"DELETE FROM {index.table.name} AS older USING {index.table.name} AS newer WHERE {matches} AND newer.id > older.id"
+    ))
+    print(f"Removed {result.rowcount} duplicate rows from {index.table.name} for {index.name}")
+
+async def remove_duplicates():
+  async with engine.begin() as conn:
+    await conn.run_sync(delete_duplicates)
+  invalidate_all_blocks(get_redis())
+
+# Main async function to execute all tasks
+async def main(args):
+  if args.remove_duplicates:
+    await remove_duplicates()
+  elif args.incremental:
+    await ingest_incremental(args.file, args.parsers, args.writers)
+  else:
+    await ingest_full(args.file)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Load SIPX prices and consumption/production data from a CSV file")
+  parser.add_argument("--file", default=DATA_FILE, help="CSV file to load")
+  parser.add_argument("--incremental", action="store_true", help="only upsert rows newer than the last checkpoint instead of reloading everything")
+  parser.add_argument("--parsers", type=int, default=4, help="processes used to parse the CSV in incremental mode")
+  parser.add_argument("--writers", type=int, default=4, help="concurrent database connections used in incremental mode")
+  parser.add_argument("--remove-duplicates", action="store_true", help="delete the older rows that keep a new unique index from being created, then exit")
 
-# Run the main function
-asyncio.run(main())
+  # Run the main function
+  asyncio.run(main(parser.parse_args()))
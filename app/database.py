@@ -1,4 +1,5 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import inspect
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
@@ -23,4 +24,15 @@ async def get_db():
     try:
       yield db
     finally:
-      await db.close()
\ No newline at end of file
+      await db.close()
+
+# indexes declared on the models that the database does not have yet, create_all skips them on existing tables
+def missing_indexes(sync_conn):
+  inspector = inspect(sync_conn)
+  missing = []
+  for table in Base.metadata.sorted_tables:
+    if not inspector.has_table(table.name):
+      continue
+    existing = {index["name"] for index in inspector.get_indexes(table.name)}
+    missing += [index for index in table.indexes if index.name not in existing]
+  return missing
@@ -0,0 +1,95 @@
+import numpy as np
+from datetime import datetime, timezone
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import ConsumptionProduction, SIPXPrice
+from app.packed_series import PACKED_STORAGE, fetch_customer_blocks, unpack_series
+
+# Largest-Triangle-Three-Buckets, returns the indexes of the points to keep
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+  n = len(x)
+  if threshold >= n or threshold < 3:
+    return np.arange(n)
+
+  every = (n - 2) / (threshold - 2)
+  indexes = np.empty(threshold, dtype=np.int64)
+  indexes[0], indexes[-1] = 0, n - 1
+
+  selected = 0
+  for i in range(threshold - 2):
+    # average of the next bucket is the third corner of the triangle
+    next_start = int((i + 1) * every) + 1
+    next_end = min(int((i + 2) * every) + 1, n)
+    next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+    start, end = int(i * every) + 1, int((i + 1) * every) + 1
+    areas = np.abs(
+      (x[selected] - next_x) * (y[start:end] - y[selected])
+      - (x[selected] - x[start:end]) * (next_y - y[selected])
+    )
+    selected = start + int(np.argmax(areas))
+    indexes[i + 1] = selected
+
+  return indexes
+
+# min, max and average per fixed-width bucket aligned to the epoch, x must be sorted
+def min_max_buckets(x: np.ndarray, y: np.ndarray, width: float):
+  keys = np.floor(x / width).astype(np.int64)
+  starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+  counts = np.diff(np.r_[starts, len(y)])
+  return (
+    keys[starts] * width,
+    np.minimum.reduceat(y, starts),
+    np.maximum.reduceat(y, starts),
+    np.add.reduceat(y, starts) / counts
+  )
+
+def to_datetime(seconds: float) -> datetime:
+  return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+# reduces a series to about `points` points, or to buckets of `bucket_seconds` with method "minmax"
+def downsample(x: np.ndarray, y: np.ndarray, method: str, points: int, bucket_seconds: float = None):
+  if method == "minmax" or bucket_seconds:
+    width = bucket_seconds or max((x[-1] - x[0]) / points, 1.0)
+    bucket_x, mins, maxs, avgs = min_max_buckets(x, y, width)
+    return [
+      {"timestamp": to_datetime(timestamp), "value": avg, "min": low, "max": high}
+      for timestamp, low, high, avg in zip(bucket_x.tolist(), mins.tolist(), maxs.tolist(), avgs.tolist())
+    ]
+
+  indexes = lttb(x, y, points)
+  return [
+    {"timestamp": to_datetime(timestamp), "value": value}
+    for timestamp, value in zip(x[indexes].tolist(), y[indexes].tolist())
+  ]
+
+# loads timestamps (epoch seconds) and values as arrays, skipping missing values
+async def fetch_series(db: AsyncSession, timestamp_column, value_column, filters, start: datetime = None, end: datetime = None):
+  query = select(timestamp_column, value_column).filter(*filters, value_column != None)
+  if start is not None:
+    query = query.filter(timestamp_column >= start)
+  if end is not None:
+    query = query.filter(timestamp_column <= end)
+
+  result = await db.execute(query.order_by(timestamp_column))
+  rows = result.all()
+  x = np.fromiter((row[0].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+  y = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+  return x, y
+
+async def fetch_price_series(db: AsyncSession, start: datetime = None, end: datetime = None):
+  return await fetch_series(db, SIPXPrice.timestamp, SIPXPrice.price_EUR_kWh, [], start, end)
+
+async def fetch_customer_series(db: AsyncSession, customer_id: int, field: str, start: datetime = None, end: datetime = None):
+  if PACKED_STORAGE:
+    blocks = await fetch_customer_blocks(db, customer_id, start=start, end=end)
+    return unpack_series(blocks, field, start, end)
+
+  return await fetch_series(
+    db,
+    ConsumptionProduction.timestamp,
+    getattr(ConsumptionProduction, field),
+    [ConsumptionProduction.customer_id == customer_id],
+    start,
+    end
+  )
@@ -0,0 +1,36 @@
+import os
+import asyncio
+from app.database import AsyncSessionLocal
+from app.redis_client import get_redis, get_async_redis
+from app.exports import (
+  EXPORT_QUEUE, EXPORT_PROCESSING, run_export, update_export_job, remove_expired_exports, requeue_unfinished_exports
+)
+
+# number of exports processed at the same time, each holds one DB connection and one chunk in memory
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+
+# takes jobs from the queue one at a time, a job leaves the processing list only once it is done or failed
+async def export_worker():
+  queue = get_async_redis()
+  redis = get_redis()
+  while True:
+    job_id = await queue.blmove(EXPORT_QUEUE, EXPORT_PROCESSING, 0, "LEFT", "RIGHT")
+    if job_id is None:
+      continue
+    job_id = job_id.decode()
+    try:
+      await asyncio.to_thread(remove_expired_exports)
+      async with AsyncSessionLocal() as db:
+        await run_export(redis, db, job_id)
+    except Exception as error:
+      update_export_job(redis, job_id, status="failed", error=str(error))
+    finally:
+      await queue.lrem(EXPORT_PROCESSING, 1, job_id)
+
+# runs as a single process, jobs left in the processing list belong to a previous run
+async def main():
+  requeue_unfinished_exports(get_redis())
+  await asyncio.gather(*(export_worker() for _ in range(EXPORT_WORKERS)))
+
+if __name__ == "__main__":
+  asyncio.run(main())
@@ -0,0 +1,212 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import time
+import uuid
+import redis
+from datetime import datetime, timezone
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import ConsumptionProduction, ConsumptionProductionBlock, Customer
+from app.packed_series import PACKED_STORAGE, HOURS_PER_BLOCK, block_day, unpack_blocks
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_QUEUE = "export_jobs_queue"
+# jobs taken by the worker stay here until they finish, so a crash does not lose them
+EXPORT_PROCESSING = "export_jobs_processing"
+# finished jobs and their files are kept for a day
+EXPORT_JOB_TTL = 24 * 60 * 60
+# rows fetched from Postgres and written to the file at a time
+EXPORT_CHUNK_SIZE = 10000
+
+EXPORT_COLUMNS = ["customer_id", "timestamp", "consumption_kWh", "production_kWh"]
+EXPORT_EXTENSIONS = {"csv": "csv.gz", "parquet": "parquet"}
+
+def export_job_key(job_id: str) -> str:
+  return f"export_job_{job_id}"
+
+def export_path(job_id: str, format: str) -> str:
+  return os.path.join(EXPORT_DIR, f"{job_id}.{EXPORT_EXTENSIONS[format]}")
+
+def update_export_job(redis: redis.Redis, job_id: str, **fields):
+  redis.hset(export_job_key(job_id), mapping={key: json.dumps(value, default=str) for key, value in fields.items()})
+  redis.expire(export_job_key(job_id), EXPORT_JOB_TTL)
+
+def get_export_job(redis: redis.Redis, job_id: str):
+  job = redis.hgetall(export_job_key(job_id))
+  if not job:
+    return None
+  return {key.decode(): json.loads(value) for key, value in job.items()}
+
+# registers a job and queues it for the export worker
+def create_export_job(redis: redis.Redis, customer_ids, start: datetime, end: datetime, format: str):
+  job_id = uuid.uuid4().hex
+  update_export_job(
+    redis, job_id,
+    id=job_id,
+    status="queued",
+    customer_ids=customer_ids,
+    start=start.isoformat(),
+    end=end.isoformat(),
+    format=format,
+    customers_total=None,
+    customers_done=0,
+    rows_written=0,
+    error=None,
+    created_at=datetime.now(timezone.utc).isoformat()
+  )
+  redis.rpush(EXPORT_QUEUE, job_id)
+  return get_export_job(redis, job_id)
+
+# puts jobs the worker was running when it stopped back at the front of the queue
+def requeue_unfinished_exports(redis: redis.Redis):
+  while True:
+    job_id = redis.lmove(EXPORT_PROCESSING, EXPORT_QUEUE, "RIGHT", "LEFT")
+    if job_id is None:
+      return
+    if redis.exists(export_job_key(job_id.decode())):
+      update_export_job(redis, job_id.decode(), status="queued")
+
+# streams a gzip compressed CSV file
+class CsvExportWriter:
+  def __init__(self, path: str):
+    self.file = gzip.open(path, "wt", newline="")
+    self.writer = csv.writer(self.file)
+    self.writer.writerow(EXPORT_COLUMNS)
+
+  def write(self, rows):
+    self.writer.writerows(
+      (row.customer_id, row.timestamp.isoformat(), row.consumption_kWh, row.production_kWh) for row in rows
+    )
+
+  def close(self):
+    self.file.close()
+
+# streams a zstd compressed Parquet file, one row group per chunk
+class ParquetExportWriter:
+  def __init__(self, path: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    self.pa = pa
+    self.schema = pa.schema([
+      ("customer_id", pa.int32()),
+      ("timestamp", pa.timestamp("us", tz="UTC")),
+      ("consumption_kWh", pa.float64()),
+      ("production_kWh", pa.float64()),
+    ])
+    self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+  def write(self, rows):
+    self.writer.write_table(self.pa.Table.from_pylist(
+      [{column: getattr(row, column) for column in EXPORT_COLUMNS} for row in rows],
+      schema=self.schema
+    ))
+
+  def close(self):
+    self.writer.close()
+
+EXPORT_WRITERS = {"csv": CsvExportWriter, "parquet": ParquetExportWriter}
+
+async def resolve_customer_ids(db: AsyncSession, customer_ids):
+  query = select(Customer.id).filter(Customer.deleted_at == None).order_by(Customer.id)
+  # only a missing list means every active customer
+  if customer_ids is not None:
+    query = query.filter(Customer.id.in_(customer_ids))
+  result = await db.execute(query)
+  return result.scalars().all()
+
+# streams the job's rows from Postgres in chunks, file writes run in a thread
+async def run_export(redis: redis.Redis, db: AsyncSession, job_id: str):
+  job = get_export_job(redis, job_id)
+  if job is None:
+    return
+
+  customer_ids = await resolve_customer_ids(db, job["customer_ids"])
+  update_export_job(redis, job_id, status="running", customers_total=len(customer_ids))
+
+  path = export_path(job_id, job["format"])
+  partial_path = f"{path}.part"
+  os.makedirs(EXPORT_DIR, exist_ok=True)
+  writer = await asyncio.to_thread(EXPORT_WRITERS[job["format"]], partial_path)
+
+  try:
+    start, end = datetime.fromisoformat(job["start"]), datetime.fromisoformat(job["end"])
+    if PACKED_STORAGE:
+      chunks = stream_packed_rows(db, customer_ids, start, end)
+    else:
+      chunks = stream_rows(db, customer_ids, start, end)
+
+    rows_written = 0
+    customers_seen = set()
+    async for rows in chunks:
+      await asyncio.to_thread(writer.write, rows)
+      rows_written += len(rows)
+      customers_seen.update(row.customer_id for row in rows)
+      # the last customer in a chunk may continue in the next one
+      update_export_job(redis, job_id, rows_written=rows_written, customers_done=len(customers_seen) - 1)
+  except Exception:
+    await asyncio.to_thread(writer.close)
+    os.remove(partial_path)
+    raise
+
+  await asyncio.to_thread(writer.close)
+
+  os.replace(partial_path, path)
+  update_export_job(redis, job_id, status="done", customers_done=len(customer_ids), rows_written=rows_written)
+
+# yields the rows in chunks from a server-side cursor
+async def stream_rows(db: AsyncSession, customer_ids, start: datetime, end: datetime):
+  result = await db.stream(
+    select(
+      ConsumptionProduction.customer_id,
+      ConsumptionProduction.timestamp,
+      ConsumptionProduction.consumption_kWh,
+      ConsumptionProduction.production_kWh
+    )
+    .filter(
+      ConsumptionProduction.customer_id.in_(customer_ids),
+      ConsumptionProduction.timestamp >= start,
+      ConsumptionProduction.timestamp <= end,
+      ConsumptionProduction.deleted_at == None
+    )
+    .order_by(ConsumptionProduction.customer_id, ConsumptionProduction.timestamp)
+    .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+  )
+  async for rows in result.partitions(EXPORT_CHUNK_SIZE):
+    yield rows
+
+# same as stream_rows for the packed layout, each block unpacks into up to 24 rows
+async def stream_packed_rows(db: AsyncSession, customer_ids, start: datetime, end: datetime):
+  blocks_per_chunk = EXPORT_CHUNK_SIZE // HOURS_PER_BLOCK
+  result = await db.stream(
+    select(ConsumptionProductionBlock)
+    .filter(
+      ConsumptionProductionBlock.customer_id.in_(customer_ids),
+      ConsumptionProductionBlock.day >= block_day(start),
+      ConsumptionProductionBlock.day <= end,
+      ConsumptionProductionBlock.deleted_at == None
+    )
+    .order_by(ConsumptionProductionBlock.customer_id, ConsumptionProductionBlock.day)
+    .execution_options(yield_per=blocks_per_chunk)
+  )
+  async for blocks in result.scalars().partitions(blocks_per_chunk):
+    rows = unpack_blocks(blocks, start, end)
+    if rows:
+      yield rows
+
+# removes files of jobs that have expired
+def remove_expired_exports():
+  if not os.path.isdir(EXPORT_DIR):
+    return
+  cutoff = time.time() - EXPORT_JOB_TTL
+  for name in os.listdir(EXPORT_DIR):
+    path = os.path.join(EXPORT_DIR, name)
+    try:
+      if os.path.getmtime(path) < cutoff:
+        os.remove(path)
+    except FileNotFoundError:
+      # another worker removed it first
+      pass
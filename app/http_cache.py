@@ -0,0 +1,115 @@
+import asyncio
+import gzip
+import time
+import brotli
+import redis
+import zstandard
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request, Response
+from app.single_flight import get_or_load
+
+# bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+BODY_CACHE_TTL = 360
+
+ENCODERS = {
+  "zstd": lambda body: zstandard.ZstdCompressor(level=3).compress(body),
+  "br": lambda body: brotli.compress(body, quality=5),
+  "gzip": lambda body: gzip.compress(body, compresslevel=6),
+}
+ENCODING_PREFERENCE = ["zstd", "br", "gzip"]
+
+def sipx_prices_version_key() -> str:
+  return "sipx_prices_version"
+
+def customer_data_version_key(customer_id: int) -> str:
+  return f"customer_{customer_id}_data_version"
+
+# records that a resource changed, the version is the modification time in milliseconds
+def bump_data_version(redis: redis.Redis, key: str):
+  redis.set(key, int(time.time() * 1000))
+
+# reads the version without touching the data, a missing version starts at the current time
+def get_data_version(redis: redis.Redis, key: str) -> int:
+  version = redis.get(key)
+  if version is None:
+    redis.set(key, int(time.time() * 1000), nx=True)
+    version = redis.get(key)
+  return int(version)
+
+def is_not_modified(request: Request, version: int) -> bool:
+  if_none_match = request.headers.get("if-none-match")
+  if if_none_match is not None:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or f'"{version}"' in tags
+
+  if_modified_since = request.headers.get("if-modified-since")
+  if if_modified_since is not None:
+    try:
+      since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+      return False
+    # the version is in milliseconds, Last-Modified only has whole seconds
+    return version < since * 1000
+
+  return False
+
+# Last-Modified is the first whole second after the version, if that second had passed before the version
+# was read: any later write then has a version at or after it, so `version < since` tells them apart.
+# A version from the current second gets its own (earlier) second, which never answers 304.
+def last_modified_seconds(version: int, read_at: float) -> int:
+  return min(version // 1000 + 1, int(read_at))
+
+# picks the preferred encoding the client accepts
+def choose_encoding(request: Request) -> str:
+  accepted = set()
+  for part in request.headers.get("accept-encoding", "").split(","):
+    encoding, _, params = part.partition(";")
+    params = params.strip().replace(" ", "")
+    try:
+      quality = float(params[2:]) if params.startswith("q=") else 1.0
+    except ValueError:
+      quality = 0.0
+    if quality > 0:
+      accepted.add(encoding.strip().lower())
+
+  for encoding in ENCODING_PREFERENCE:
+    if encoding in accepted:
+      return encoding
+  return "identity"
+
+# serves a JSON body with ETag/Last-Modified validators, answering 304 before the body is built;
+# bodies and their compressed variants are cached per data version
+async def conditional_json_response(request: Request, redis: redis.Redis, version_key: str, body_key: str, build_body):
+  read_at = time.time()
+  version = get_data_version(redis, version_key)
+  headers = {
+    "ETag": f'W/"{version}"',
+    "Last-Modified": formatdate(last_modified_seconds(version, read_at), usegmt=True),
+    "Cache-Control": "no-cache",
+    "Vary": "Accept-Encoding",
+  }
+
+  if is_not_modified(request, version):
+    return Response(status_code=304, headers=headers)
+
+  identity_key = f"{body_key}_{version}_identity"
+
+  async def load_identity_body():
+    return await get_or_load(redis, identity_key, BODY_CACHE_TTL, build_body)
+
+  encoding = choose_encoding(request)
+  if encoding == "identity":
+    return Response(content=await load_identity_body(), media_type="application/json", headers=headers)
+
+  # small bodies are cached as an empty variant, meaning the identity body is sent instead
+  async def compress_body():
+    identity_body = await load_identity_body()
+    if len(identity_body) < COMPRESSION_MIN_SIZE:
+      return b""
+    return await asyncio.to_thread(ENCODERS[encoding], identity_body)
+
+  body = await get_or_load(redis, f"{body_key}_{version}_{encoding}", BODY_CACHE_TTL, compress_body)
+  if not body:
+    return Response(content=await load_identity_body(), media_type="application/json", headers=headers)
+  return Response(content=body, media_type="application/json", headers={**headers, "Content-Encoding": encoding})
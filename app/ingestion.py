@@ -0,0 +1,57 @@
+import pandas as pd
+
+# Parsing helpers for app/add_customers.py. They run in worker processes, so this module
+# must stay free of import-time side effects such as engines or loaded CSV files.
+
+def read_columns(path: str):
+  return pd.read_csv(path, sep=",", nrows=0).columns.tolist()
+
+# splits the customer columns into groups that keep each customer's cons/prod columns together
+def customer_column_groups(columns, group_count: int):
+  customer_names = sorted({col.split("_")[0] for col in columns if col.startswith("customer")})
+  groups = [customer_names[i::group_count] for i in range(group_count)]
+  return [
+    [col for col in columns if col.startswith("customer") and col.split("_")[0] in group]
+    for group in groups if group
+  ]
+
+def read_rows_since(path: str, columns, since):
+  df = pd.read_csv(path, sep=",", usecols=["timestamp_utc", *columns])
+  df["timestamp_utc"] = pd.to_datetime(df["timestamp_utc"], utc=True)
+  if since is not None:
+    df = df[df["timestamp_utc"] >= since]
+  # NaN becomes None so it is stored as NULL
+  return df.astype(object).where(df.notna(), None)
+
+# parses SIPX prices newer than since
+def parse_prices(path: str, since):
+  df = read_rows_since(path, ["SIPX_EUR_kWh"], since)
+  return [
+    {"timestamp": timestamp.to_pydatetime(), "price_EUR_kWh": price}
+    for timestamp, price in zip(df["timestamp_utc"], df["SIPX_EUR_kWh"])
+    if price is not None
+  ]
+
+# parses consumption/production rows newer than since for one group of customer columns
+def parse_customer_group(path: str, columns, since):
+  df = read_rows_since(path, columns, since)
+  timestamps = [timestamp.to_pydatetime() for timestamp in df["timestamp_utc"]]
+
+  rows = {}
+  for col in columns:
+    parts = col.split("_")
+    customer_name, data_type = parts[0], parts[1]
+    if data_type == "cons":
+      field = "consumption_kWh"
+    elif data_type == "prod":
+      field = "production_kWh"
+    else:
+      continue
+
+    for timestamp, value in zip(timestamps, df[col]):
+      key = (customer_name, timestamp)
+      if key not in rows:
+        rows[key] = {"customer_name": customer_name, "timestamp": timestamp, "consumption_kWh": None, "production_kWh": None}
+      rows[key][field] = value
+
+  return list(rows.values())
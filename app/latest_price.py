@@ -0,0 +1,53 @@
+import json
+import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import SIPXPrice
+from app.redis_client import redis_client
+
+LATEST_PRICE_KEY = "sipx_latest_price"
+
+# moves the pointer only forward in time, unless the entry it already points to is being rewritten
+SET_LATEST_PRICE_SCRIPT = """
+local current_ts = redis.call('HGET', KEYS[1], 'ts')
+local current_id = redis.call('HGET', KEYS[1], 'id')
+if current_ts and current_id ~= ARGV[3] and tonumber(current_ts) > tonumber(ARGV[2]) then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'data', ARGV[1], 'ts', ARGV[2], 'id', ARGV[3])
+return 1
+"""
+# registered once, the SHA is computed here and the script is loaded on the first call
+set_latest_price_script = redis_client.register_script(SET_LATEST_PRICE_SCRIPT)
+
+# atomically points the latest price at this entry if it is not older than the current one
+def set_latest_price(redis: redis.Redis, price: SIPXPrice):
+  return set_latest_price_script(
+    keys=[LATEST_PRICE_KEY],
+    args=[json.dumps(price.to_dict()), price.timestamp.timestamp(), price.id],
+    client=redis
+  )
+
+# indexed LIMIT 1 lookup used when the pointer is missing
+async def query_latest_price(db: AsyncSession):
+  result = await db.execute(select(SIPXPrice).order_by(SIPXPrice.timestamp.desc()).limit(1))
+  return result.scalars().first()
+
+# serves the latest price from the pointer and rebuilds it on a miss
+async def get_latest_price_entry(redis: redis.Redis, db: AsyncSession):
+  cached_data = redis.hget(LATEST_PRICE_KEY, "data")
+  if cached_data:
+    return json.loads(cached_data)
+
+  latest_entry = await query_latest_price(db)
+  if latest_entry:
+    set_latest_price(redis, latest_entry)
+  return latest_entry
+
+# replaces the pointer unconditionally, used after bulk loads that may remove newer rows
+async def refresh_latest_price(redis: redis.Redis, db: AsyncSession):
+  latest_entry = await query_latest_price(db)
+  redis.delete(LATEST_PRICE_KEY)
+  if latest_entry:
+    set_latest_price(redis, latest_entry)
+  return latest_entry
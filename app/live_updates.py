@@ -0,0 +1,107 @@
+import asyncio
+import json
+import redis
+from app.redis_client import get_async_redis
+
+PRICE_CHANNEL = "sipx_price_updates"
+CUSTOMER_CHANNEL_PREFIX = "consumption_production_updates_"
+
+# messages a subscriber may have waiting before it is considered too slow
+SUBSCRIBER_QUEUE_SIZE = 100
+
+def customer_channel(customer_id: int) -> str:
+  return f"{CUSTOMER_CHANNEL_PREFIX}{customer_id}"
+
+# publishes a change to every API worker
+def publish(redis: redis.Redis, channel: str, message: dict):
+  redis.publish(channel, json.dumps(message, default=str))
+
+def publish_price_update(redis: redis.Redis, price):
+  publish(redis, PRICE_CHANNEL, {"type": "sipx_price", "data": price.to_dict()})
+
+def publish_consumption_production_update(redis: redis.Redis, entry):
+  publish(redis, customer_channel(entry.customer_id), {"type": "consumption_production", "data": entry.to_dict()})
+
+# a connected client and the updates it is interested in
+class Subscriber:
+  def __init__(self, prices: bool = False, customer_ids=None):
+    self.prices = prices
+    self.customer_ids = set(customer_ids or [])
+    self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+  def wants(self, channel: str) -> bool:
+    if channel == PRICE_CHANNEL:
+      return self.prices
+    if channel.startswith(CUSTOMER_CHANNEL_PREFIX):
+      return int(channel[len(CUSTOMER_CHANNEL_PREFIX):]) in self.customer_ids
+    return False
+
+  # hands a message to the client; a full queue means the client can't keep up,
+  # so its backlog is dropped and it is told to disconnect and resync
+  def deliver(self, message: str):
+    try:
+      self.queue.put_nowait(message)
+    except asyncio.QueueFull:
+      while not self.queue.empty():
+        self.queue.get_nowait()
+      self.queue.put_nowait(None)
+
+  # waits for the next message, None means the subscriber fell behind
+  async def next_message(self):
+    return await self.queue.get()
+
+# keeps one Redis subscription per worker and fans messages out to local subscribers
+class LiveUpdateBroker:
+  def __init__(self):
+    self.subscribers = set()
+    self.listener = None
+
+  def subscribe(self, subscriber: Subscriber):
+    self.subscribers.add(subscriber)
+
+  def unsubscribe(self, subscriber: Subscriber):
+    self.subscribers.discard(subscriber)
+
+  def dispatch(self, channel: str, message: str):
+    for subscriber in list(self.subscribers):
+      if subscriber.wants(channel):
+        subscriber.deliver(message)
+
+  async def listen(self):
+    client = get_async_redis()
+    pubsub = client.pubsub()
+    try:
+      await pubsub.subscribe(PRICE_CHANNEL)
+      await pubsub.psubscribe(f"{CUSTOMER_CHANNEL_PREFIX}*")
+      async for message in pubsub.listen():
+        if message["type"] not in ("message", "pmessage"):
+          continue
+        self.dispatch(message["channel"].decode(), message["data"].decode())
+    finally:
+      await pubsub.aclose()
+      await client.aclose()
+
+  # restarts the listener if the Redis connection drops
+  async def run(self):
+    while True:
+      try:
+        await self.listen()
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        await asyncio.sleep(1)
+
+  def start(self):
+    if self.listener is None:
+      self.listener = asyncio.create_task(self.run())
+
+  async def stop(self):
+    if self.listener is not None:
+      self.listener.cancel()
+      try:
+        await self.listener
+      except asyncio.CancelledError:
+        pass
+      self.listener = None
+
+broker = LiveUpdateBroker()
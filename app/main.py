@@ -1,19 +1,60 @@
 from fastapi import FastAPI
-from .routers import consumption_production, customers, sipx_prices
-from .database import Base, engine
+from .routers import consumption_production, customers, sipx_prices, live_updates, exports
+from sqlalchemy import text
+from .database import Base, engine, missing_indexes
+from .live_updates import broker
 
 app = FastAPI()
 
 # Async function to initialize the database schema
 async def init_db():
   async with engine.begin() as conn:
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
     await conn.run_sync(Base.metadata.create_all)
+    await conn.run_sync(create_missing_indexes)
+
+# indexes that were replaced under a new name
+RETIRED_INDEXES = ["ix_customers_name_lower_prefix", "ix_sipx_prices_timestamp"]
+
+# number of conflicting keys listed when a unique index cannot be created
+DUPLICATE_SAMPLE_SIZE = 10
+
+# create_all skips indexes on tables that already exist, so add them explicitly
+def create_missing_indexes(sync_conn):
+  for name in RETIRED_INDEXES:
+    sync_conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+  for index in missing_indexes(sync_conn):
+    if index.unique:
+      check_no_duplicates(sync_conn, index)
+    index.create(sync_conn)
+
+# a unique index cannot be built over duplicate rows, stop with the conflicting keys rather than deleting data at startup
+def check_no_duplicates(sync_conn, index):
+  columns = [column.name for column in index.columns]
+  quoted = ", ".join(f'"{column}"' for column in columns)
+  groups = sync_conn.execute(text(
+    f"SELECT {quoted}, count(*) OVER () FROM {index.table.name} GROUP BY {quoted} HAVING count(*) > 1 ORDER BY {quoted} LIMIT {DUPLICATE_SAMPLE_SIZE}"
+  )).all()
+  if groups:
+    keys = ", ".join("(" + ", ".join(str(value) for value in group[:-1]) + ")" for group in groups)
+    raise RuntimeError(
+      f"Cannot create unique index {index.name}: {index.table.name}({', '.join(columns)}) has {groups[0][-1]} duplicated keys, "
+      f"for example {keys}. Run `python -m app.add_customers --remove-duplicates` to keep only the newest row of each key, then restart."
+    )
 
 @app.on_event("startup")
 async def startup():
   await init_db()
+  broker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+  await broker.stop()
 
 # Include routers
 app.include_router(customers.router)
 app.include_router(consumption_production.router)
 app.include_router(sipx_prices.router)
+app.include_router(live_updates.router)
+app.include_router(exports.router)
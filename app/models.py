@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, LargeBinary, func
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -13,6 +13,13 @@ class Customer(Base):
 
   data = relationship("ConsumptionProduction", back_populates="customer")
 
+  __table_args__ = (
+    # trigram index for fuzzy search (requires the pg_trgm extension)
+    Index("ix_customers_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    # btree index on lower(name) in the "C" collation, serves both the prefix LIKE and the ORDER BY of autocomplete
+    Index("ix_customers_name_lower_c", func.lower(name).collate("C")),
+  )
+
   def to_dict(self):
     return {
     "id": self.id,
@@ -34,6 +41,11 @@ class ConsumptionProduction(Base):
 
   customer = relationship("Customer", back_populates="data")
 
+  __table_args__ = (
+    # one reading per customer and hour, also serves per-customer range queries and upserts
+    Index("ux_consumption_production_customer_timestamp", "customer_id", "timestamp", unique=True),
+  )
+
   def to_dict(self):
     return {
       "id": self.id,
@@ -41,9 +53,24 @@ class ConsumptionProduction(Base):
       "timestamp": self.timestamp.isoformat(),  
       "consumption_kWh": self.consumption_kWh,
       "production_kWh": self.production_kWh, 
-      "deleted_a": self.deleted_at
+      "deleted_at": self.deleted_at.isoformat() if self.deleted_at else None
     }
 
+# compact layout used when STORAGE_MODE=packed, one row per customer-day, see app/packed_series.py
+class ConsumptionProductionBlock(Base):
+  __tablename__ = "consumption_production_blocks"
+
+  id = Column(Integer, primary_key=True)
+  customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+  day = Column(DateTime(timezone=True), nullable=False)  # UTC midnight
+  consumption_kWh = Column(LargeBinary, nullable=False)  # 24 little-endian float32 values, NaN for missing
+  production_kWh = Column(LargeBinary, nullable=False)
+  deleted_at = Column(DateTime, nullable=True)  # Soft delete column
+
+  __table_args__ = (
+    Index("ux_consumption_production_blocks_customer_day", "customer_id", "day", unique=True),
+  )
+
 class SIPXPrice(Base):
   __tablename__ = "sipx_prices"
 
@@ -51,9 +78,20 @@ class SIPXPrice(Base):
   timestamp = Column(DateTime(timezone=True), nullable=False)
   price_EUR_kWh = Column(Float, nullable=False)
 
+  __table_args__ = (
+    # one price per hour, also serves timestamp lookups and the ingestion upserts
+    Index("ux_sipx_prices_timestamp", "timestamp", unique=True),
+  )
+
   def to_dict(self):
     return {
       "id": self.id,
       "timestamp": self.timestamp.isoformat(),  
       "price_EUR_kWh": self.price_EUR_kWh
-    }
\ No newline at end of file
+    }
+
+class IngestionCheckpoint(Base):
+  __tablename__ = "ingestion_checkpoints"
+
+  source = Column(String, primary_key=True)  # source file name
+  last_timestamp = Column(DateTime(timezone=True), nullable=False)  # newest timestamp ingested from the source
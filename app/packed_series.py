@@ -0,0 +1,251 @@
+import os
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import ConsumptionProduction, ConsumptionProductionBlock
+
+# "rows" stores one row per customer-hour, "packed" one row per customer-day holding float32 arrays
+STORAGE_MODE = os.getenv("STORAGE_MODE", "rows")
+PACKED_STORAGE = STORAGE_MODE == "packed"
+
+HOURS_PER_BLOCK = 24
+HOUR = timedelta(hours=1)
+VALUE_DTYPE = np.dtype("<f4")
+
+# the table holding consumption-production data in the configured layout, both have customer_id and deleted_at
+def customer_data_model():
+  return ConsumptionProductionBlock if PACKED_STORAGE else ConsumptionProduction
+
+# first and last timestamp (day in packed mode) of a customer's data, (None, None) when there is no data
+async def customer_data_range(db: AsyncSession, customer_id: int):
+  column = ConsumptionProductionBlock.day if PACKED_STORAGE else ConsumptionProduction.timestamp
+  model = customer_data_model()
+  result = await db.execute(select(func.min(column), func.max(column)).filter(model.customer_id == customer_id))
+  return result.one()
+
+# a reading of a packed block, with the same attributes as a ConsumptionProduction row
+class PackedReading:
+  def __init__(self, id, customer_id, timestamp, consumption_kWh, production_kWh, deleted_at=None):
+    self.id = id
+    self.customer_id = customer_id
+    self.timestamp = timestamp
+    self.consumption_kWh = consumption_kWh
+    self.production_kWh = production_kWh
+    self.deleted_at = deleted_at
+
+  def to_dict(self):
+    return {
+      "id": self.id,
+      "customer_id": self.customer_id,
+      "timestamp": self.timestamp.isoformat(),
+      "consumption_kWh": self.consumption_kWh,
+      "production_kWh": self.production_kWh,
+      "deleted_at": self.deleted_at.isoformat() if self.deleted_at else None
+    }
+
+# naive timestamps are treated as UTC, blocks start at UTC midnight
+def as_utc(timestamp: datetime) -> datetime:
+  if timestamp.tzinfo is None:
+    return timestamp.replace(tzinfo=timezone.utc)
+  return timestamp.astimezone(timezone.utc)
+
+def block_day(timestamp: datetime) -> datetime:
+  return as_utc(timestamp).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def hour_of_block(timestamp: datetime) -> int:
+  return (as_utc(timestamp) - block_day(timestamp)) // HOUR
+
+def clamp_hour(hour: int) -> int:
+  return min(max(hour, 0), HOURS_PER_BLOCK)
+
+# readings are addressed by block id and hour, so ids stay unique and stable
+def reading_id(block_id: int, hour: int) -> int:
+  return block_id * HOURS_PER_BLOCK + hour
+
+def split_reading_id(entry_id: int):
+  return divmod(entry_id, HOURS_PER_BLOCK)
+
+def empty_values() -> np.ndarray:
+  return np.full(HOURS_PER_BLOCK, np.nan, dtype=VALUE_DTYPE)
+
+def encode_values(values: np.ndarray) -> bytes:
+  return np.asarray(values, dtype=VALUE_DTYPE).tobytes()
+
+def decode_values(data: bytes) -> np.ndarray:
+  return np.frombuffer(data, dtype=VALUE_DTYPE)
+
+# widens float32 values through their shortest repr, so 0.1 is returned as 0.1 and not 0.10000000149
+def to_float64(values: np.ndarray) -> np.ndarray:
+  return values.astype(str).astype(np.float64)
+
+def optional_float(value):
+  return None if np.isnan(value) else float(value)
+
+# unpacks blocks into readings, keeping only hours within [start, end]
+def unpack_blocks(blocks, start: datetime = None, end: datetime = None):
+  readings = []
+  for block in blocks:
+    first_hour, last_hour = 0, HOURS_PER_BLOCK
+    if start is not None:
+      # first whole hour at or after start
+      first_hour = clamp_hour(-((block.day - as_utc(start)) // HOUR))
+    if end is not None:
+      last_hour = clamp_hour((as_utc(end) - block.day) // HOUR + 1)
+    if first_hour >= last_hour:
+      continue
+
+    consumption = to_float64(decode_values(block.consumption_kWh)[first_hour:last_hour])
+    production = to_float64(decode_values(block.production_kWh)[first_hour:last_hour])
+    present = ~(np.isnan(consumption) & np.isnan(production))
+
+    for offset in np.nonzero(present)[0]:
+      hour = first_hour + int(offset)
+      readings.append(PackedReading(
+        reading_id(block.id, hour),
+        block.customer_id,
+        block.day + hour * HOUR,
+        optional_float(consumption[offset]),
+        optional_float(production[offset]),
+        block.deleted_at
+      ))
+  return readings
+
+# groups rows by customer and day into sorted packed blocks, with a mask of the hours that have a row
+def pack_rows(rows):
+  blocks = {}
+  for row in rows:
+    key = (row["customer_id"], block_day(row["timestamp"]))
+    if key not in blocks:
+      blocks[key] = (empty_values(), empty_values(), np.zeros(HOURS_PER_BLOCK, dtype=bool))
+    consumption, production, present = blocks[key]
+    hour = hour_of_block(row["timestamp"])
+    consumption[hour] = np.nan if row["consumption_kWh"] is None else row["consumption_kWh"]
+    production[hour] = np.nan if row["production_kWh"] is None else row["production_kWh"]
+    present[hour] = True
+  return sorted(blocks.items(), key=lambda block: block[0])
+
+# makes sure the blocks exist so they can be locked, concurrent creators of the same block do not conflict
+async def ensure_blocks(db: AsyncSession, keys):
+  empty = encode_values(empty_values())
+  await db.execute(
+    insert(ConsumptionProductionBlock)
+    .values([{"customer_id": customer_id, "day": day, "consumption_kWh": empty, "production_kWh": empty} for customer_id, day in keys])
+    .on_conflict_do_nothing(index_elements=["customer_id", "day"])
+  )
+
+# writes packed rows into the stored blocks like row upserts do: hours with a row are replaced,
+# the other hours keep their stored values; blocks are locked in key order, so writers cannot deadlock
+async def merge_packed_blocks(db: AsyncSession, blocks):
+  if not blocks:
+    return
+  await ensure_blocks(db, [key for key, _ in blocks])
+  result = await db.execute(
+    select(
+      ConsumptionProductionBlock.id,
+      ConsumptionProductionBlock.customer_id,
+      ConsumptionProductionBlock.day,
+      ConsumptionProductionBlock.consumption_kWh,
+      ConsumptionProductionBlock.production_kWh
+    )
+    .filter(tuple_(ConsumptionProductionBlock.customer_id, ConsumptionProductionBlock.day).in_([key for key, _ in blocks]))
+    .order_by(ConsumptionProductionBlock.customer_id, ConsumptionProductionBlock.day)
+    .with_for_update()
+  )
+
+  incoming = dict(blocks)
+  updates = []
+  for block in result.all():
+    consumption, production, present = incoming[(block.customer_id, block.day)]
+    merged_consumption = encode_values(np.where(present, consumption, decode_values(block.consumption_kWh)))
+    merged_production = encode_values(np.where(present, production, decode_values(block.production_kWh)))
+    if merged_consumption != block.consumption_kWh or merged_production != block.production_kWh:
+      updates.append({"id": block.id, "consumption_kWh": merged_consumption, "production_kWh": merged_production})
+
+  if updates:
+    await db.execute(update(ConsumptionProductionBlock), updates)
+
+# unpacks one field of the blocks into epoch seconds and values at once, skipping missing hours
+def unpack_series(blocks, field: str, start: datetime = None, end: datetime = None):
+  if not blocks:
+    return np.empty(0), np.empty(0)
+
+  days = np.array([block.day.timestamp() for block in blocks])
+  x = (days[:, None] + np.arange(HOURS_PER_BLOCK) * HOUR.total_seconds()).ravel()
+  y = to_float64(np.frombuffer(b"".join(getattr(block, field) for block in blocks), dtype=VALUE_DTYPE))
+
+  present = ~np.isnan(y)
+  if start is not None:
+    present &= x >= as_utc(start).timestamp()
+  if end is not None:
+    present &= x <= as_utc(end).timestamp()
+  return x[present], y[present]
+
+async def fetch_customer_blocks(db: AsyncSession, customer_id: int, days=None, start: datetime = None, end: datetime = None):
+  query = select(ConsumptionProductionBlock).filter(ConsumptionProductionBlock.customer_id == customer_id)
+  if days is not None:
+    query = query.filter(ConsumptionProductionBlock.day.in_(days))
+  if start is not None:
+    query = query.filter(ConsumptionProductionBlock.day >= block_day(start))
+  if end is not None:
+    query = query.filter(ConsumptionProductionBlock.day <= end)
+  result = await db.execute(query.order_by(ConsumptionProductionBlock.day))
+  return result.scalars().all()
+
+# stores one reading, returns None if the hour already holds data
+async def create_packed_reading(db: AsyncSession, customer_id: int, timestamp: datetime, consumption_kWh, production_kWh):
+  day, hour = block_day(timestamp), hour_of_block(timestamp)
+  # a missing block is created first, so the lock below always has a row to hold
+  await ensure_blocks(db, [(customer_id, day)])
+  result = await db.execute(
+    select(ConsumptionProductionBlock)
+    .filter(ConsumptionProductionBlock.customer_id == customer_id, ConsumptionProductionBlock.day == day)
+    .with_for_update()
+  )
+  block = result.scalars().one()
+
+  consumption = decode_values(block.consumption_kWh).copy()
+  production = decode_values(block.production_kWh).copy()
+  if not (np.isnan(consumption[hour]) and np.isnan(production[hour])):
+    return None
+
+  consumption[hour] = np.nan if consumption_kWh is None else consumption_kWh
+  production[hour] = np.nan if production_kWh is None else production_kWh
+  block.consumption_kWh = encode_values(consumption)
+  block.production_kWh = encode_values(production)
+
+  return PackedReading(reading_id(block.id, hour), customer_id, day + hour * HOUR, consumption_kWh, production_kWh)
+
+# updates the values of one reading, returns None if it does not exist
+async def update_packed_reading(db: AsyncSession, entry_id: int, consumption_kWh, production_kWh):
+  block_id, hour = split_reading_id(entry_id)
+  result = await db.execute(
+    select(ConsumptionProductionBlock).filter(ConsumptionProductionBlock.id == block_id).with_for_update()
+  )
+  block = result.scalars().first()
+  if not block:
+    return None
+
+  timestamp = block.day + hour * HOUR
+  consumption = decode_values(block.consumption_kWh).copy()
+  production = decode_values(block.production_kWh).copy()
+  if np.isnan(consumption[hour]) and np.isnan(production[hour]):
+    return None
+
+  if consumption_kWh is not None:
+    consumption[hour] = consumption_kWh
+  if production_kWh is not None:
+    production[hour] = production_kWh
+  block.consumption_kWh = encode_values(consumption)
+  block.production_kWh = encode_values(production)
+
+  return PackedReading(
+    entry_id,
+    block.customer_id,
+    timestamp,
+    optional_float(to_float64(consumption[hour:hour + 1])[0]),
+    optional_float(to_float64(production[hour:hour + 1])[0]),
+    block.deleted_at
+  )
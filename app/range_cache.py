@@ -0,0 +1,167 @@
+import json
+import time
+import redis
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import ConsumptionProduction, SIPXPrice
+from app.packed_series import PACKED_STORAGE, as_utc, block_day, unpack_blocks, fetch_customer_blocks
+
+# blocks are invalidated by the write paths, the TTL only bounds memory use
+RANGE_CACHE_TTL = 3600
+# part of every block key, bumped when the cached row format changes so older blocks are never read
+BLOCK_FORMAT = 2
+# block versions outlive the blocks stored under them
+BLOCK_VERSION_TTL = 2 * RANGE_CACHE_TTL
+
+# block boundaries are UTC calendar days and months
+def block_start(value: datetime, unit: str) -> datetime:
+  value = block_day(value)
+  if unit == "month":
+    value = value.replace(day=1)
+  return value
+
+def next_block(block: datetime, unit: str) -> datetime:
+  if unit == "month":
+    return (block + timedelta(days=32)).replace(day=1)
+  return block + timedelta(days=1)
+
+def blocks_between(start: datetime, end: datetime, unit: str):
+  blocks = []
+  block = block_start(start, unit)
+  while block <= as_utc(end):
+    blocks.append(block)
+    block = next_block(block, unit)
+  return blocks
+
+# increments the versions atomically, a missing version starts just above the current time in milliseconds
+def bump_block_versions(redis: redis.Redis, version_keys):
+  if not version_keys:
+    return
+  now = int(time.time() * 1000)
+  pipeline = redis.pipeline(transaction=True)
+  for version_key in version_keys:
+    pipeline.set(version_key, now, nx=True)
+    pipeline.incr(version_key)
+    pipeline.expire(version_key, BLOCK_VERSION_TTL)
+  pipeline.execute()
+
+# a time series cached in fixed calendar blocks, so overlapping ranges share cached work
+class BlockCachedSeries:
+  def __init__(self, key_prefix: str, unit: str, model, filters=()):
+    self.key_prefix = key_prefix
+    self.unit = unit
+    self.model = model
+    self.filters = list(filters)
+
+  def label(self, block: datetime) -> str:
+    return block.strftime("%Y-%m" if self.unit == "month" else "%Y-%m-%d")
+
+  # blocks are stored under their current version, so a reader that loaded a block before a write
+  # committed stores it under a version nobody reads anymore instead of overwriting the fresh one
+  def key(self, block: datetime, version: int) -> str:
+    return f"{self.key_prefix}_{self.label(block)}_f{BLOCK_FORMAT}_v{version}"
+
+  def version_key(self, block: datetime) -> str:
+    return f"{self.key_prefix}_{self.label(block)}_version"
+
+  # a missing version starts at the current time in milliseconds, so it never repeats an older one
+  def versions(self, redis: redis.Redis, blocks):
+    version_keys = [self.version_key(block) for block in blocks]
+    versions = redis.mget(version_keys)
+    if None in versions:
+      now = int(time.time() * 1000)
+      pipeline = redis.pipeline()
+      for version_key, version in zip(version_keys, versions):
+        if version is None:
+          pipeline.set(version_key, now, nx=True, ex=BLOCK_VERSION_TTL)
+      pipeline.execute()
+      versions = redis.mget(version_keys)
+    return [int(version) for version in versions]
+
+  # fetches all missing blocks in one query, merging neighbouring blocks into one range
+  async def fetch_blocks(self, db: AsyncSession, blocks):
+    runs = []
+    for block in blocks:
+      if runs and runs[-1][1] == block:
+        runs[-1][1] = next_block(block, self.unit)
+      else:
+        runs.append([block, next_block(block, self.unit)])
+
+    result = await db.execute(
+      select(self.model)
+      .filter(*self.filters, or_(*(and_(self.model.timestamp >= start, self.model.timestamp < end) for start, end in runs)))
+      .order_by(self.model.timestamp)
+    )
+
+    fetched = {block: [] for block in blocks}
+    for row in result.scalars().all():
+      fetched[block_start(row.timestamp, self.unit)].append(row.to_dict())
+    return fetched
+
+  # assembles the range from cached blocks, fetching only the missing ones, and trims it to the bounds
+  async def get_range(self, redis: redis.Redis, db: AsyncSession, start: datetime, end: datetime):
+    blocks = blocks_between(start, end, self.unit)
+    if not blocks:
+      return []
+
+    keys = {block: self.key(block, version) for block, version in zip(blocks, self.versions(redis, blocks))}
+    cached_blocks = redis.mget([keys[block] for block in blocks])
+    data = {block: json.loads(cached) for block, cached in zip(blocks, cached_blocks) if cached is not None}
+
+    missing = [block for block in blocks if block not in data]
+    if missing:
+      fetched = await self.fetch_blocks(db, missing)
+      pipeline = redis.pipeline()
+      for block, rows in fetched.items():
+        pipeline.set(keys[block], json.dumps(rows, default=str), ex=RANGE_CACHE_TTL)
+      pipeline.execute()
+      data.update(fetched)
+
+    start, end = as_utc(start), as_utc(end)
+    return [
+      row for block in blocks for row in data[block]
+      if start <= datetime.fromisoformat(row["timestamp"]) <= end
+    ]
+
+  # moves the blocks to a new version, called after the write has committed
+  def bump_versions(self, redis: redis.Redis, blocks):
+    bump_block_versions(redis, [self.version_key(block) for block in blocks])
+
+  # invalidates the block holding this timestamp
+  def invalidate(self, redis: redis.Redis, timestamp: datetime):
+    self.bump_versions(redis, [block_start(timestamp, self.unit)])
+
+  # invalidates every block overlapping the range
+  def invalidate_range(self, redis: redis.Redis, start: datetime, end: datetime):
+    self.bump_versions(redis, blocks_between(start, end, self.unit))
+
+# reads the day blocks straight from the packed layout, cache blocks and packed blocks are both UTC days
+class PackedCustomerSeries(BlockCachedSeries):
+  def __init__(self, customer_id: int):
+    super().__init__(f"customer_{customer_id}_consumption_block", "day", ConsumptionProduction)
+    self.customer_id = customer_id
+
+  async def fetch_blocks(self, db: AsyncSession, blocks):
+    fetched = {block: [] for block in blocks}
+    for reading in unpack_blocks(await fetch_customer_blocks(db, self.customer_id, blocks)):
+      fetched[block_start(reading.timestamp, self.unit)].append(reading.to_dict())
+    return fetched
+
+def customer_series(customer_id: int) -> BlockCachedSeries:
+  if PACKED_STORAGE:
+    return PackedCustomerSeries(customer_id)
+  return BlockCachedSeries(
+    f"customer_{customer_id}_consumption_block",
+    "day",
+    ConsumptionProduction,
+    [ConsumptionProduction.customer_id == customer_id]
+  )
+
+price_series = BlockCachedSeries("sipx_prices_block", "month", SIPXPrice)
+
+# invalidates every cached block, used after bulk loads; the old blocks expire with their TTL
+def invalidate_all_blocks(redis: redis.Redis):
+  for pattern in ("customer_*_consumption_block_*_version", "sipx_prices_block_*_version"):
+    bump_block_versions(redis, list(redis.scan_iter(match=pattern, count=1000)))
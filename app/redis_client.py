@@ -1,15 +1,27 @@
+import os
 import redis
+import redis.asyncio
 from fastapi import Depends
+from dotenv import load_dotenv
+
+load_dotenv()
 
 # Define settings to load from .env
-redis_host: str = "redis"
-redis_port: int = 6379
-redis_db: int = 0
+redis_host: str = os.getenv("REDIS_HOST", "redis")
+redis_port: int = int(os.getenv("REDIS_PORT", 6379))
+redis_db: int = int(os.getenv("REDIS_DB", 0))
+
 
+# Shared Redis client, its connection pool is reused across requests
+redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
 
 # Initialize the Redis client
 def get_redis():
-  return redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+  return redis_client
+
+# Async client for long-lived connections such as pub/sub listeners
+def get_async_redis():
+  return redis.asyncio.Redis(host=redis_host, port=redis_port, db=redis_db)
 
 # Dependency
 def get_redis_client(redis: redis.Redis = Depends(get_redis)):
@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from ..database import get_db 
 import app.schemas as schemas
-import json
 import redis
 from app.redis_client import get_redis_client
+from app.live_updates import publish_consumption_production_update
+from app.range_cache import customer_series, price_series
+from app.http_cache import conditional_json_response, bump_data_version, customer_data_version_key
+from app.packed_series import PACKED_STORAGE, unpack_blocks, fetch_customer_blocks, create_packed_reading, update_packed_reading
+from app.downsample import downsample, fetch_customer_series
+from pydantic import TypeAdapter
+from typing import Literal, Optional
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from app.models import ConsumptionProduction, Customer, SIPXPrice
+from app.models import ConsumptionProduction, Customer
 from datetime import datetime
 
 limiter = Limiter(key_func=get_remote_address)
@@ -18,32 +24,49 @@ router = APIRouter(
   tags=["Consumption production"]
 )
 
+entry_list_adapter = TypeAdapter(list[schemas.ConsumptionProduction])
+series_adapter = TypeAdapter(list[schemas.SeriesPoint])
+
 # add consumption-production data to customer
 @router.post("/", response_model=schemas.ConsumptionProduction)
 @limiter.limit("20/minute")
-async def create_consumption_production(request: Request, data: schemas.ConsumptionProductionCreate, db: AsyncSession = Depends(get_db)):
+async def create_consumption_production(request: Request, data: schemas.ConsumptionProductionCreate, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
   # Ensure customer exists before inserting consumption-production data
   result = await db.execute(select(Customer).filter(Customer.id == data.customer_id))
   customer = result.scalars().first()
   if not customer:
     raise HTTPException(status_code=400, detail="Customer does not exist")
 
-  # Ensure that the customer doesn't already have consumption-production data at the given timestamp
-  result = await db.execute(select(ConsumptionProduction).filter(
-    ConsumptionProduction.customer_id == data.customer_id,
-    ConsumptionProduction.timestamp == data.timestamp
-  ))
-  consumption_production_data = result.scalars().first()
-
-  # If data already exists, raise an error 
-  if consumption_production_data:
-    raise HTTPException(status_code=409, detail="Data already exists")
-
-  # Add consumption-production data
-  time_series_entry = ConsumptionProduction(**data.model_dump())
-  db.add(time_series_entry)
-  await db.commit()  # Async commit
-  await db.refresh(time_series_entry)  # Async refresh
+  if PACKED_STORAGE:
+    # An empty hour is a NaN in both arrays, so a reading without values could not be read back
+    if data.consumption_kWh is None and data.production_kWh is None:
+      raise HTTPException(status_code=422, detail="consumption_kWh or production_kWh is required")
+    # Writes the hour into the customer's packed day block, None means the hour already has data
+    time_series_entry = await create_packed_reading(db, data.customer_id, data.timestamp, data.consumption_kWh, data.production_kWh)
+    if not time_series_entry:
+      raise HTTPException(status_code=409, detail="Data already exists")
+    await db.commit()  # Async commit
+  else:
+    # Ensure that the customer doesn't already have consumption-production data at the given timestamp
+    result = await db.execute(select(ConsumptionProduction).filter(
+      ConsumptionProduction.customer_id == data.customer_id,
+      ConsumptionProduction.timestamp == data.timestamp
+    ))
+    consumption_production_data = result.scalars().first()
+
+    # If data already exists, raise an error 
+    if consumption_production_data:
+      raise HTTPException(status_code=409, detail="Data already exists")
+
+    # Add consumption-production data
+    time_series_entry = ConsumptionProduction(**data.model_dump())
+    db.add(time_series_entry)
+    await db.commit()  # Async commit
+    await db.refresh(time_series_entry)  # Async refresh
+
+  customer_series(time_series_entry.customer_id).invalidate(redis, time_series_entry.timestamp)
+  bump_data_version(redis, customer_data_version_key(time_series_entry.customer_id))
+  publish_consumption_production_update(redis, time_series_entry)
 
   return time_series_entry
 
@@ -51,69 +74,108 @@ async def create_consumption_production(request: Request, data: schemas.Consumpt
 @router.get("/{customer_id}", response_model=list[schemas.ConsumptionProduction])
 @limiter.limit("20/minute")
 async def get_consumption_production_all(request: Request, customer_id: int, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
-  # get data from redis
-  redis_name = f"customer_{customer_id}_production_consumption"
-  cached_data = redis.get(redis_name) 
 
-  # if it exists return json
-  if cached_data:
-    return json.loads(cached_data)
+  async def build_body():
+    # database query
+    if PACKED_STORAGE:
+      data = unpack_blocks(await fetch_customer_blocks(db, customer_id))
+    else:
+      result = await db.execute(select(ConsumptionProduction).filter(ConsumptionProduction.customer_id == customer_id))
+      data = result.scalars().all()
+    if not data:
+      raise HTTPException(status_code=404, detail="No data found for customer")
+    return entry_list_adapter.dump_json(entry_list_adapter.validate_python(data, from_attributes=True))
 
-  # database query
-  result = await db.execute(select(ConsumptionProduction).filter(ConsumptionProduction.customer_id == customer_id))
-  data = result.scalars().all()
-  if not data:
-    raise HTTPException(status_code=404, detail="No data found for customer")
-
-  redis.set(redis_name, json.dumps([price.to_dict() for price in data]), ex=360)
-  return data
+  redis_name = f"customer_{customer_id}_production_consumption"
+  return await conditional_json_response(request, redis, customer_data_version_key(customer_id), redis_name, build_body)
 
 # get consumption and production data for a customer in a given range
 @router.get("/{customer_id}/range", response_model=list[schemas.ConsumptionProduction])
 @limiter.limit("20/minute")
-async def get_consumption_data(request: Request, customer_id: int, start: datetime, end: datetime, db: AsyncSession = Depends(get_db)):
-  result = await db.execute(select(ConsumptionProduction).filter(
-    ConsumptionProduction.customer_id == customer_id,
-    ConsumptionProduction.timestamp >= start,
-    ConsumptionProduction.timestamp <= end
-  ))
-  data = result.scalars().all()
+async def get_consumption_data(request: Request, customer_id: int, start: datetime, end: datetime, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
+  data = await customer_series(customer_id).get_range(redis, db, start, end)
   if not data: 
     raise HTTPException(status_code=404, detail="No data found for customer")
   return data
 
+# gets a downsampled consumption or production series for plotting, LTTB by default or min/max/avg buckets
+@router.get("/{customer_id}/series", response_model=list[schemas.SeriesPoint])
+@limiter.limit("20/minute")
+async def get_consumption_production_series(
+  request: Request,
+  customer_id: int,
+  field: Literal["consumption_kWh", "production_kWh"] = "consumption_kWh",
+  start: Optional[datetime] = None,
+  end: Optional[datetime] = None,
+  points: int = Query(500, ge=3, le=5000),
+  method: Literal["lttb", "minmax"] = "lttb",
+  bucket_hours: Optional[int] = Query(None, ge=1),
+  redis: redis.Redis = Depends(get_redis_client),
+  db: AsyncSession = Depends(get_db)
+):
+
+  async def build_body():
+    x, y = await fetch_customer_series(db, customer_id, field, start, end)
+    if len(x) == 0:
+      raise HTTPException(status_code=404, detail="No data found for customer")
+    points_data = downsample(x, y, method, points, bucket_hours * 3600 if bucket_hours else None)
+    return series_adapter.dump_json(series_adapter.validate_python(points_data), exclude_none=True)
+
+  # cached per data version, range and resolution
+  body_key = f"customer_{customer_id}_{field}_series_{start}_{end}_{method}_{points}_{bucket_hours}"
+  return await conditional_json_response(request, redis, customer_data_version_key(customer_id), body_key, build_body)
+
 # calculates the total revenue and cost of a customer in a given range
 @router.get("/{customer_id}/total", response_model=schemas.CostRevenueSummary)
 @limiter.limit("20/minute")
-async def calculate_cost_revenue(request: Request, customer_id: int, start: datetime, end: datetime, db: AsyncSession = Depends(get_db)):
-  data = await get_consumption_data(customer_id, start, end, db)  # Use the async version of get_consumption_data
-  result = await db.execute(select(SIPXPrice).filter(SIPXPrice.timestamp.between(start, end)))
-  prices = result.scalars().all()
-  price_map = {price.timestamp: price.price_EUR_kWh for price in prices}
+async def calculate_cost_revenue(request: Request, customer_id: int, start: datetime, end: datetime, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
+  data = await customer_series(customer_id).get_range(redis, db, start, end)
+  if not data:
+    raise HTTPException(status_code=404, detail="No data found for customer")
+  prices = await price_series.get_range(redis, db, start, end)
+  price_map = {datetime.fromisoformat(price["timestamp"]): price["price_EUR_kWh"] for price in prices}
+
+  # a total with unpriced hours would be silently too low
+  unpriced = [
+    d["timestamp"] for d in data
+    if (d["consumption_kWh"] or d["production_kWh"]) and datetime.fromisoformat(d["timestamp"]) not in price_map
+  ]
+  if unpriced:
+    raise HTTPException(status_code=422, detail=f"No SIPX price for {len(unpriced)} hours in range, first at {unpriced[0]}")
 
   # calculates the cost and revenue
-  total_cost = sum(d.consumption_kWh * price_map[d.timestamp] for d in data if d.consumption_kWh)
-  total_revenue = sum(d.production_kWh * price_map[d.timestamp] for d in data if d.production_kWh)
+  total_cost = sum(d["consumption_kWh"] * price_map[datetime.fromisoformat(d["timestamp"])] for d in data if d["consumption_kWh"])
+  total_revenue = sum(d["production_kWh"] * price_map[datetime.fromisoformat(d["timestamp"])] for d in data if d["production_kWh"])
 
   return {"total_cost": total_cost, "total_revenue": total_revenue}
 
 # updates a consumption-production entry
 @router.patch("/{entry_id}", response_model=schemas.ConsumptionProductionUpdate)
 @limiter.limit("20/minute")
-async def update_consumption_production(request: Request, entry_id: int, update_data: schemas.ConsumptionProductionUpdate, db: AsyncSession = Depends(get_db)):
-  result = await db.execute(select(ConsumptionProduction).filter(ConsumptionProduction.id == entry_id))
-  entry = result.scalars().first()
-
-  if not entry:
-    raise HTTPException(status_code=404, detail="Consumption-Production entry not found")
-
-  if update_data.consumption_kWh is not None:
-    entry.consumption_kWh = update_data.consumption_kWh
-
-  if update_data.production_kWh is not None:
-    entry.production_kWh = update_data.production_kWh
-
-  await db.commit()  # Async commit
-  await db.refresh(entry)  # Async refresh
+async def update_consumption_production(request: Request, entry_id: int, update_data: schemas.ConsumptionProductionUpdate, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
+  if PACKED_STORAGE:
+    entry = await update_packed_reading(db, entry_id, update_data.consumption_kWh, update_data.production_kWh)
+    if not entry:
+      raise HTTPException(status_code=404, detail="Consumption-Production entry not found")
+    await db.commit()  # Async commit
+  else:
+    result = await db.execute(select(ConsumptionProduction).filter(ConsumptionProduction.id == entry_id))
+    entry = result.scalars().first()
+
+    if not entry:
+      raise HTTPException(status_code=404, detail="Consumption-Production entry not found")
+
+    if update_data.consumption_kWh is not None:
+      entry.consumption_kWh = update_data.consumption_kWh
+
+    if update_data.production_kWh is not None:
+      entry.production_kWh = update_data.production_kWh
+
+    await db.commit()  # Async commit
+    await db.refresh(entry)  # Async refresh
+
+  customer_series(entry.customer_id).invalidate(redis, entry.timestamp)
+  bump_data_version(redis, customer_data_version_key(entry.customer_id))
+  publish_consumption_production_update(redis, entry)
   return entry
 
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
 from sqlalchemy.future import select
 from app.database import get_db 
 import app.schemas as schemas
@@ -7,7 +8,12 @@ import json
 import redis
 from app.redis_client import get_redis_client
 from datetime import datetime, timezone
-from app.models import Customer, ConsumptionProduction
+from app.models import Customer
+from app.packed_series import customer_data_model, customer_data_range
+from app.http_cache import bump_data_version, customer_data_version_key
+from app.range_cache import customer_series
+from app.search import search_customers, autocomplete_customers
+from app.single_flight import get_or_load
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
@@ -42,34 +48,36 @@ async def get_customer(request: Request, customer_id: int, db: AsyncSession = De
 @router.get("/")
 @limiter.limit("20/minute")
 async def get_all_customers(request: Request, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
-  cached_data = redis.get("customers")
 
-  if cached_data:
-    return json.loads(cached_data)
+  async def load_customers():
+    result = await db.execute(select(Customer).filter(Customer.deleted_at == None))
+    data = result.scalars().all()
+    return json.dumps([customer.to_dict() for customer in data], default=str)
 
-  result = await db.execute(select(Customer).filter(Customer.deleted_at == None))
-  data = result.scalars().all()
+  # concurrent misses share one query, see app/single_flight.py
+  return json.loads(await get_or_load(redis, "active_customers", 360, load_customers))
 
-  redis.set("customers", json.dumps([price.to_dict() for price in data]), ex=360) 
-
-  return data
-
-# gets all customers with specified name 
+# gets active customers whose name matches, best matches first
 @router.get("/search/", response_model=list[schemas.Customer])
 @limiter.limit("20/minute")
-async def search_customer(request: Request, name: str, db: AsyncSession = Depends(get_db)):
-  result = await db.execute(select(Customer).filter(Customer.name.ilike(f"%{name}%")))
-  customers = result.scalars().all()
-  
+async def search_customer(request: Request, name: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=100), db: AsyncSession = Depends(get_db)):
+  customers = await search_customers(db, name, limit)
+
   if not customers:
     raise HTTPException(status_code=404, detail="No customers found")
 
   return customers
 
+# suggests active customers whose name starts with the given prefix
+@router.get("/search/autocomplete", response_model=list[schemas.CustomerSuggestion])
+@limiter.limit("120/minute")
+async def autocomplete_customer(request: Request, prefix: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50), redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
+  return await autocomplete_customers(db, redis, prefix, limit)
+
 # marks a customer and their consumption-production data as deleted
 @router.delete("/customers/{customer_id}")
 @limiter.limit("20/minute")
-async def soft_delete_customer(request: Request, customer_id: int, db: AsyncSession = Depends(get_db)):
+async def soft_delete_customer(request: Request, customer_id: int, db: AsyncSession = Depends(get_db), redis: redis.Redis = Depends(get_redis_client)):
   result = await db.execute(select(Customer).filter(Customer.id == customer_id, Customer.deleted_at == None))
   customer = result.scalars().first()
   if not customer:
@@ -77,19 +85,25 @@ async def soft_delete_customer(request: Request, customer_id: int, db: AsyncSess
 
   # marks the customer and their data as deleted
   customer.deleted_at = datetime.now(timezone.utc)
+  data_model = customer_data_model()
   await db.execute(
-    select(ConsumptionProduction).filter(ConsumptionProduction.customer_id == customer_id).update(
-      {"deleted_at": datetime.now(timezone.utc)}
-    )
+    # deleted_at of the data tables is a naive UTC timestamp
+    update(data_model).where(data_model.customer_id == customer_id).values(deleted_at=datetime.now(timezone.utc).replace(tzinfo=None))
   )
+  start, end = await customer_data_range(db, customer_id)
   await db.commit()
+  # cached bodies and range blocks still hold the data as not deleted
+  bump_data_version(redis, customer_data_version_key(customer_id))
+  if start is not None:
+    customer_series(customer_id).invalidate_range(redis, start, end)
   return {"message": f"Customer {customer_id} and associated data marked as deleted"}
 
 # deletes a customer if they had no associated data
 @router.delete("/{customer_id}", status_code=204)
 @limiter.limit("20/minute")
 async def delete_customer_if_no_data(request: Request, customer_id: int, db: AsyncSession = Depends(get_db)):
-  result = await db.execute(select(ConsumptionProduction).filter(ConsumptionProduction.customer_id == customer_id))
+  data_model = customer_data_model()
+  result = await db.execute(select(data_model.id).filter(data_model.customer_id == customer_id).limit(1))
   has_data = result.scalars().first()
 
   if has_data:
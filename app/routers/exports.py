@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
+import app.schemas as schemas
+import os
+import redis
+from app.redis_client import get_redis_client
+from app.exports import create_export_job, get_export_job, export_path
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+limiter = Limiter(key_func=get_remote_address)
+
+router = APIRouter(
+  prefix="/exports",
+  tags=["Exports"]
+)
+
+# queues an export of consumption-production data, the file is built by the export worker
+@router.post("/", response_model=schemas.ExportJob, status_code=202)
+@limiter.limit("5/minute")
+async def create_export(request: Request, data: schemas.ExportJobCreate, redis: redis.Redis = Depends(get_redis_client)):
+  if data.start > data.end:
+    raise HTTPException(status_code=400, detail="Start must be before end")
+  if data.customer_ids is not None and not data.customer_ids:
+    # omitting customer_ids exports everyone, an empty list is almost certainly a mistake
+    raise HTTPException(status_code=400, detail="customer_ids must not be empty, omit it to export all customers")
+  return create_export_job(redis, data.customer_ids, data.start, data.end, data.format)
+
+# reports the status and progress of an export
+@router.get("/{job_id}", response_model=schemas.ExportJob)
+@limiter.limit("60/minute")
+async def get_export(request: Request, job_id: str, redis: redis.Redis = Depends(get_redis_client)):
+  job = get_export_job(redis, job_id)
+  if not job:
+    raise HTTPException(status_code=404, detail="Export not found")
+  return job
+
+# downloads the file of a finished export
+@router.get("/{job_id}/download")
+@limiter.limit("20/minute")
+async def download_export(request: Request, job_id: str, redis: redis.Redis = Depends(get_redis_client)):
+  job = get_export_job(redis, job_id)
+  if not job:
+    raise HTTPException(status_code=404, detail="Export not found")
+
+  if job["status"] != "done":
+    raise HTTPException(status_code=409, detail=f"Export is {job['status']}")
+
+  path = export_path(job_id, job["format"])
+  if not os.path.exists(path):
+    raise HTTPException(status_code=404, detail="Export file has expired")
+
+  media_type = "application/gzip" if job["format"] == "csv" else "application/vnd.apache.parquet"
+  return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
@@ -0,0 +1,96 @@
+from fastapi import APIRouter, Query, Request, WebSocket
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+from pydantic import ValidationError
+from app.live_updates import broker, Subscriber
+import app.schemas as schemas
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+limiter = Limiter(key_func=get_remote_address)
+
+router = APIRouter(
+  prefix="/live",
+  tags=["Live updates"]
+)
+
+# seconds between keep-alive comments on idle event streams
+SSE_KEEPALIVE = 15
+
+# receives subscription changes such as {"action": "subscribe", "prices": true, "customer_ids": [1, 2]},
+# a message that is not a valid subscription change closes the connection with 1003
+async def receive_subscription_changes(websocket: WebSocket, subscriber: Subscriber):
+  while True:
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+      return
+
+    try:
+      change = schemas.SubscriptionChange.model_validate_json(message.get("text") or "")
+    except ValidationError:
+      await websocket.close(code=1003, reason="Invalid subscription message")
+      return
+
+    if change.action == "subscribe":
+      subscriber.customer_ids |= set(change.customer_ids)
+      if change.prices:
+        subscriber.prices = True
+    else:
+      subscriber.customer_ids -= set(change.customer_ids)
+      if change.prices:
+        subscriber.prices = False
+
+async def send_updates(websocket: WebSocket, subscriber: Subscriber):
+  while True:
+    message = await subscriber.next_message()
+    if message is None:
+      # the client fell behind, it should reconnect and refetch
+      await websocket.close(code=1013, reason="Subscriber too slow")
+      return
+    await websocket.send_text(message)
+
+# pushes price and consumption-production updates over a WebSocket
+@router.websocket("/ws")
+async def live_updates_websocket(websocket: WebSocket, prices: bool = False, customer_ids: list[int] = Query([])):
+  await websocket.accept()
+  subscriber = Subscriber(prices=prices, customer_ids=customer_ids)
+  broker.subscribe(subscriber)
+
+  tasks = [
+    asyncio.create_task(receive_subscription_changes(websocket, subscriber)),
+    asyncio.create_task(send_updates(websocket, subscriber)),
+  ]
+  try:
+    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in done:
+      task.result()
+  finally:
+    broker.unsubscribe(subscriber)
+    for task in tasks:
+      task.cancel()
+
+# pushes price and consumption-production updates as Server-Sent Events
+@router.get("/sse")
+@limiter.limit("20/minute")
+async def live_updates_sse(request: Request, prices: bool = False, customer_ids: list[int] = Query([])):
+  subscriber = Subscriber(prices=prices, customer_ids=customer_ids)
+  broker.subscribe(subscriber)
+
+  async def event_stream():
+    try:
+      while not await request.is_disconnected():
+        try:
+          message = await asyncio.wait_for(subscriber.next_message(), timeout=SSE_KEEPALIVE)
+        except asyncio.TimeoutError:
+          yield ": keep-alive\n\n"
+          continue
+
+        if message is None:
+          yield "event: lagged\ndata: {}\n\n"
+          return
+        yield f"event: {json.loads(message)['type']}\ndata: {message}\n\n"
+    finally:
+      broker.unsubscribe(subscriber)
+
+  return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_db 
 import app.schemas as schemas
-import json
 import redis
 from app.redis_client import get_redis_client
 from datetime import datetime
 from app.models import SIPXPrice
+from app.latest_price import set_latest_price, get_latest_price_entry
+from app.live_updates import publish_price_update
+from app.range_cache import price_series
+from app.http_cache import conditional_json_response, bump_data_version, sipx_prices_version_key
+from app.downsample import downsample, fetch_price_series
+from pydantic import TypeAdapter
+from typing import Literal, Optional
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
@@ -18,10 +24,13 @@ router = APIRouter(
   tags=["Sipx prices"]
 )
 
+price_list_adapter = TypeAdapter(list[schemas.SIPXPrice])
+series_adapter = TypeAdapter(list[schemas.SeriesPoint])
+
 # creates new entry with price and timestamp
 @router.post("/", response_model=schemas.SIPXPrice)
 @limiter.limit("20/minute")
-async def create_price_entry(request: Request, data: schemas.SIPXPriceCreate, db: AsyncSession = Depends(get_db)):
+async def create_price_entry(request: Request, data: schemas.SIPXPriceCreate, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
   # Check if a price entry already exists for the given timestamp
   result = await db.execute(select(SIPXPrice).filter(SIPXPrice.timestamp == data.timestamp))
   existing_entry = result.scalars().first()
@@ -34,6 +43,10 @@ async def create_price_entry(request: Request, data: schemas.SIPXPriceCreate, db
   db.add(price_entry)
   await db.commit()  # Async commit
   await db.refresh(price_entry)  # Async refresh
+  set_latest_price(redis, price_entry)
+  price_series.invalidate(redis, price_entry.timestamp)
+  bump_data_version(redis, sipx_prices_version_key())
+  publish_price_update(redis, price_entry)
   return price_entry
 
 # gets all prices
@@ -41,27 +54,18 @@ async def create_price_entry(request: Request, data: schemas.SIPXPriceCreate, db
 @limiter.limit("20/minute")
 async def get_all_prices(request: Request, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
 
-  cached_data = redis.get("spix_prices")
-
-  if cached_data:
-    return json.loads(cached_data)
+  async def build_body():
+    result = await db.execute(select(SIPXPrice))
+    data = result.scalars().all()
+    return price_list_adapter.dump_json(price_list_adapter.validate_python(data, from_attributes=True))
 
-  result = await db.execute(select(SIPXPrice))
-  data = result.scalars().all()
-
-  redis.set("spix_prices", json.dumps([price.to_dict() for price in data]), ex=360) 
-
-  return data
+  return await conditional_json_response(request, redis, sipx_prices_version_key(), "spix_prices", build_body)
 
 # gets a range of prices from start to end
 @router.get("/range", response_model=list[schemas.SIPXPrice])
 @limiter.limit("20/minute")
-async def get_prices_in_range(request: Request, start: datetime, end: datetime, db: AsyncSession = Depends(get_db)):
-  result = await db.execute(select(SIPXPrice).filter(
-    SIPXPrice.timestamp >= start,
-    SIPXPrice.timestamp <= end
-  ))
-  data = result.scalars().all()
+async def get_prices_in_range(request: Request, start: datetime, end: datetime, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
+  data = await price_series.get_range(redis, db, start, end)
   
   # If data doesn't exist, raise an error
   if not data:
@@ -69,12 +73,36 @@ async def get_prices_in_range(request: Request, start: datetime, end: datetime,
   
   return data
 
+# gets a downsampled price series for plotting, LTTB by default or min/max/avg buckets
+@router.get("/series", response_model=list[schemas.SeriesPoint])
+@limiter.limit("20/minute")
+async def get_price_series(
+  request: Request,
+  start: Optional[datetime] = None,
+  end: Optional[datetime] = None,
+  points: int = Query(500, ge=3, le=5000),
+  method: Literal["lttb", "minmax"] = "lttb",
+  bucket_hours: Optional[int] = Query(None, ge=1),
+  redis: redis.Redis = Depends(get_redis_client),
+  db: AsyncSession = Depends(get_db)
+):
+
+  async def build_body():
+    x, y = await fetch_price_series(db, start, end)
+    if len(x) == 0:
+      raise HTTPException(status_code=404, detail="No data found in the given range")
+    points_data = downsample(x, y, method, points, bucket_hours * 3600 if bucket_hours else None)
+    return series_adapter.dump_json(series_adapter.validate_python(points_data), exclude_none=True)
+
+  # cached per data version, range and resolution
+  body_key = f"spix_prices_series_{start}_{end}_{method}_{points}_{bucket_hours}"
+  return await conditional_json_response(request, redis, sipx_prices_version_key(), body_key, build_body)
+
 # gets the latest entry
 @router.get("/latest", response_model=schemas.SIPXPrice)
 @limiter.limit("20/minute")
-async def get_latest_price(request: Request, db: AsyncSession = Depends(get_db)):
-  result = await db.execute(select(SIPXPrice).order_by(SIPXPrice.timestamp.desc()))
-  latest_entry = result.scalars().first()
+async def get_latest_price(request: Request, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
+  latest_entry = await get_latest_price_entry(redis, db)
 
   if not latest_entry:
     raise HTTPException(status_code=404, detail="No prices available")
@@ -84,7 +112,7 @@ async def get_latest_price(request: Request, db: AsyncSession = Depends(get_db))
 # modifies the price of an entry
 @router.patch("/{price_id}", response_model=schemas.SIPXPriceUpdate)
 @limiter.limit("20/minute")
-async def update_sipx_price(request: Request, price_id: int, update_data: schemas.SIPXPriceUpdate, db: AsyncSession = Depends(get_db)):
+async def update_sipx_price(request: Request, price_id: int, update_data: schemas.SIPXPriceUpdate, redis: redis.Redis = Depends(get_redis_client), db: AsyncSession = Depends(get_db)):
   result = await db.execute(select(SIPXPrice).filter(SIPXPrice.id == price_id))
   price_entry = result.scalars().first()
   
@@ -96,5 +124,9 @@ async def update_sipx_price(request: Request, price_id: int, update_data: schema
 
   await db.commit()  # Async commit
   await db.refresh(price_entry)  # Async refresh
+  set_latest_price(redis, price_entry)
+  price_series.invalidate(redis, price_entry.timestamp)
+  bump_data_version(redis, sipx_prices_version_key())
+  publish_price_update(redis, price_entry)
 
   return price_entry
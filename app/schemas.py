@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 
 # Customer schema
 class CustomerBase(BaseModel):
@@ -23,6 +23,11 @@ class Customer(CustomerBase):
   class Config:
     from_attributes = True
 
+# Customer autocomplete suggestion schema
+class CustomerSuggestion(BaseModel):
+  id: int
+  name: str
+
 # Consumption production schema
 class ConsumptionProductionBase(BaseModel):
   timestamp: datetime
@@ -66,3 +71,36 @@ class SIPXPrice(SIPXPriceBase):
 
   class Config:
     from_attributes = True
+
+# Downsampled series schema, min and max are only set for "minmax" buckets
+class SeriesPoint(BaseModel):
+  timestamp: datetime
+  value: float
+  min: Optional[float] = None
+  max: Optional[float] = None
+
+# Export job schema
+class ExportJobCreate(BaseModel):
+  customer_ids: Optional[list[int]] = None  # all active customers when omitted
+  start: datetime
+  end: datetime
+  format: Literal["csv", "parquet"] = "csv"
+
+class ExportJob(BaseModel):
+  id: str
+  status: str
+  customer_ids: Optional[list[int]] = None
+  start: datetime
+  end: datetime
+  format: str
+  customers_total: Optional[int] = None
+  customers_done: int
+  rows_written: int
+  error: Optional[str] = None
+  created_at: datetime
+
+# Live updates subscription change, sent by WebSocket clients
+class SubscriptionChange(BaseModel):
+  action: Literal["subscribe", "unsubscribe"]
+  prices: bool = False
+  customer_ids: list[int] = []
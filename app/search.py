@@ -0,0 +1,73 @@
+import json
+import redis
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import Customer
+
+# recent autocomplete prefixes are kept just long enough to cover a burst of keystrokes
+AUTOCOMPLETE_CACHE_TTL = 30
+
+# escapes LIKE wildcards so user input is matched literally
+def escape_like(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# fuzzy search ranked by trigram similarity, served by the ix_customers_name_trgm GIN index
+async def search_customers(db: AsyncSession, name: str, limit: int):
+  similarity = func.similarity(Customer.name, name)
+  result = await db.execute(
+    select(Customer)
+    .filter(
+      Customer.deleted_at == None,
+      Customer.name.ilike(f"%{escape_like(name)}%", escape="\\") | Customer.name.op("%")(name)
+    )
+    .order_by(similarity.desc(), Customer.name)
+    .limit(limit)
+  )
+  return result.scalars().all()
+
+def autocomplete_key(prefix: str) -> str:
+  return f"customer_autocomplete_{prefix}"
+
+# looks for a cached result of this prefix or of a shorter one that can be narrowed down in memory
+def get_cached_suggestions(redis: redis.Redis, prefix: str, limit: int):
+  prefixes = [prefix[:i] for i in range(len(prefix), 0, -1)]
+  cached_entries = redis.mget([autocomplete_key(p) for p in prefixes])
+
+  for cached_prefix, cached_data in zip(prefixes, cached_entries):
+    if not cached_data:
+      continue
+    entry = json.loads(cached_data)
+
+    if cached_prefix == prefix and (entry["complete"] or entry["limit"] >= limit):
+      return entry["items"][:limit]
+
+    # a shorter prefix only helps if it holds every match, not just the first page
+    if entry["complete"]:
+      return [item for item in entry["items"] if item["name"].lower().startswith(prefix)][:limit]
+
+  return None
+
+# prefix autocomplete served by the ix_customers_name_lower_c index, which also supplies the order for the LIMIT
+async def autocomplete_customers(db: AsyncSession, redis: redis.Redis, prefix: str, limit: int):
+  prefix = prefix.lower()
+  cached_items = get_cached_suggestions(redis, prefix, limit)
+  if cached_items is not None:
+    return cached_items
+
+  name_lower = func.lower(Customer.name).collate("C")
+  result = await db.execute(
+    select(Customer.id, Customer.name)
+    .filter(
+      Customer.deleted_at == None,
+      name_lower.like(f"{escape_like(prefix)}%", escape="\\")
+    )
+    .order_by(name_lower)
+    .limit(limit)
+  )
+  items = [{"id": row.id, "name": row.name} for row in result.all()]
+
+  entry = {"complete": len(items) < limit, "limit": limit, "items": items}
+  redis.set(autocomplete_key(prefix), json.dumps(entry), ex=AUTOCOMPLETE_CACHE_TTL)
+
+  return items
@@ -0,0 +1,93 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+import redis
+from app.redis_client import redis_client
+
+# how long a worker may hold the refresh lock for a key
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+# higher values refresh earlier, 1.0 is the usual XFetch setting
+EARLY_REFRESH_BETA = 1.0
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+# loads currently running in this worker, keyed by cache key
+in_flight = {}
+
+# runs load once per key at a time, concurrent callers share the same result
+async def single_flight(key: str, load):
+  task = in_flight.get(key)
+  if task is None:
+    task = asyncio.ensure_future(load())
+    in_flight[key] = task
+    task.add_done_callback(lambda _: in_flight.pop(key, None))
+  # a cancelled caller must not cancel the load the others are waiting on
+  return await asyncio.shield(task)
+
+# XFetch: refresh before expiry with a probability that grows as expiry nears and with the load time
+def should_refresh_early(delta: float, remaining: float) -> bool:
+  return -delta * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= remaining
+
+def read_entry(redis: redis.Redis, key: str):
+  pipeline = redis.pipeline()
+  pipeline.hmget(key, "value", "delta")
+  pipeline.pttl(key)
+  (value, delta), remaining_ms = pipeline.execute()
+  return value, float(delta or 0), remaining_ms / 1000
+
+def lock_key(key: str) -> str:
+  return f"{key}_lock"
+
+# loads the value under a short Redis lock so only one worker queries the database
+async def refresh(redis: redis.Redis, key: str, ttl: int, load, stale_value):
+  token = uuid.uuid4().hex
+  locked = redis.set(lock_key(key), token, nx=True, ex=LOCK_TIMEOUT)
+
+  if not locked and stale_value is not None:
+    # another worker is refreshing, keep serving the current value
+    return stale_value
+
+  deadline = time.monotonic() + LOCK_TIMEOUT
+  while not locked and time.monotonic() < deadline:
+    await asyncio.sleep(LOCK_POLL_INTERVAL)
+    pipeline = redis.pipeline()
+    pipeline.hget(key, "value")
+    pipeline.exists(lock_key(key))
+    value, lock_held = pipeline.execute()
+    if value is not None:
+      return value
+    if not lock_held:
+      # the holder released the lock without storing a value because its load failed, take over
+      locked = redis.set(lock_key(key), token, nx=True, ex=LOCK_TIMEOUT)
+  # if the lock is still held, the holder died or is too slow, load it ourselves
+
+  try:
+    started = time.monotonic()
+    value = await load()
+    delta = time.monotonic() - started
+
+    pipeline = redis.pipeline()
+    pipeline.hset(key, mapping={"value": value, "delta": delta})
+    pipeline.expire(key, ttl)
+    pipeline.execute()
+    return value
+  finally:
+    if locked:
+      release_lock_script(keys=[lock_key(key)], args=[token], client=redis)
+
+# cache read that coalesces concurrent misses inside a worker and across workers
+async def get_or_load(redis: redis.Redis, key: str, ttl: int, load):
+  value, delta, remaining = read_entry(redis, key)
+  if value is not None and not should_refresh_early(delta, remaining):
+    return value
+
+  return await single_flight(key, lambda: refresh(redis, key, ttl, load, value))
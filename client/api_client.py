@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import random
+import time
+import httpx
+import pandas as pd
+
+BASE_URL = os.getenv("BISOL_API_URL", "http://localhost:8000")
+CACHE_DIR = os.getenv("BISOL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "bisol_client"))
+# the API limits most endpoints to 20 requests per minute per client, without a Retry-After header
+RATE_LIMIT = int(os.getenv("BISOL_RATE_LIMIT", 20))
+# a sliding window a second longer than the API's fixed one, the second covers network latency
+RATE_LIMIT_WINDOW = 61
+# backoff doubles up to this, so the retries outlast a full rate limit window
+MAX_RETRY_DELAY = 60
+
+class EnergyTrackerClient:
+  """Shared async client for the energy tracker API.
+
+  Reuses pooled keep-alive connections (HTTP/2 where the server offers it, uvicorn over plain http
+  speaks HTTP/1.1), bounds the number of requests in flight, paces requests to the API's rate limit,
+  retries rate-limited requests with backoff and keeps time series on disk as Parquet, revalidated
+  with their ETag so unchanged data is never downloaded twice.
+  """
+
+  def __init__(self, base_url=BASE_URL, max_concurrency=8, max_retries=8, rate_limit=RATE_LIMIT, cache_dir=CACHE_DIR):
+    self.client = httpx.AsyncClient(
+      base_url=base_url,
+      http2=True,
+      timeout=httpx.Timeout(30.0),
+      limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    )
+    self.semaphore = asyncio.Semaphore(max_concurrency)
+    self.max_retries = max_retries
+    self.rate_limit = rate_limit
+    self.sent_at = collections.deque()
+    self.pace_lock = asyncio.Lock()
+    self.cache_dir = cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+  async def close(self):
+    await self.client.aclose()
+
+  async def wait_for_rate_limit(self):
+    """Waits until another request fits in the rate limit, counted over a sliding window."""
+    async with self.pace_lock:
+      while len(self.sent_at) >= self.rate_limit:
+        delay = self.sent_at[0] + RATE_LIMIT_WINDOW - time.monotonic()
+        if delay > 0:
+          await asyncio.sleep(delay)
+        self.sent_at.popleft()
+      self.sent_at.append(time.monotonic())
+
+  async def request(self, path, headers=None):
+    """Sends a GET request, waiting and retrying while the API answers 429 or 503."""
+    for attempt in range(self.max_retries + 1):
+      async with self.semaphore:
+        await self.wait_for_rate_limit()
+        response = await self.client.get(path, headers=headers)
+
+      if response.status_code not in (429, 503) or attempt == self.max_retries:
+        return response
+
+      retry_after = response.headers.get("retry-after")
+      delay = float(retry_after) if retry_after and retry_after.isdigit() else min(2 ** attempt, MAX_RETRY_DELAY)
+      await asyncio.sleep(delay + random.uniform(0, 0.5))
+
+  async def get_json(self, path):
+    response = await self.request(path)
+    response.raise_for_status()
+    return response.json()
+
+  def cache_paths(self, path):
+    name = hashlib.sha1(f"{self.client.base_url}{path}".encode()).hexdigest()
+    return os.path.join(self.cache_dir, f"{name}.parquet"), os.path.join(self.cache_dir, f"{name}.json")
+
+  async def get_frame(self, path, time_columns=("timestamp",)):
+    """Fetches a JSON list as a DataFrame, served from the disk cache when the ETag still matches."""
+    frame_path, meta_path = self.cache_paths(path)
+    headers = {}
+    if os.path.exists(frame_path) and os.path.exists(meta_path):
+      with open(meta_path) as meta_file:
+        headers["If-None-Match"] = json.load(meta_file)["etag"]
+
+    response = await self.request(path, headers=headers)
+    if response.status_code == 304:
+      return await asyncio.to_thread(pd.read_parquet, frame_path)
+    response.raise_for_status()
+
+    df = pd.DataFrame(response.json())
+    for column in time_columns:
+      if column in df:
+        df[column] = pd.to_datetime(df[column])
+
+    etag = response.headers.get("etag")
+    if etag:
+      await asyncio.to_thread(df.to_parquet, frame_path, index=False)
+      with open(meta_path, "w") as meta_file:
+        json.dump({"etag": etag}, meta_file)
+    return df
+
+  async def get_customers(self):
+    return await self.get_json("/customers/")
+
+  async def get_customer(self, customer_id):
+    return await self.get_json(f"/customers/{customer_id}")
+
+  async def get_sipx_prices(self):
+    return await self.get_frame("/sipx-prices/")
+
+  async def get_sipx_price_series(self, points=1000):
+    """Fetches a downsampled price series, enough for a line chart."""
+    return await self.get_frame(f"/sipx-prices/series?points={points}")
+
+  async def get_consumption_production(self, customer_id):
+    df = await self.get_frame(f"/consumption-production/{customer_id}")
+    df["user_id"] = customer_id
+    return df
+
+  async def get_consumption_production_many(self, customer_ids):
+    """Fetches several customers concurrently, skipping those that fail."""
+    results = await asyncio.gather(
+      *(self.get_consumption_production(customer_id) for customer_id in customer_ids),
+      return_exceptions=True
+    )
+    frames = []
+    for customer_id, result in zip(customer_ids, results):
+      if isinstance(result, Exception):
+        print(f"Failed to fetch data for user {customer_id}")
+        continue
+      frames.append(result)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
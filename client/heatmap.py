@@ -1,44 +1,16 @@
 import asyncio
-import httpx
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-
-BASE_URL = "http://localhost:8000"
-
-async def fetch_user_data(client, user_id):
-  """Fetch consumption data for a given user."""
-  response = await client.get(f"{BASE_URL}/consumption-production/{user_id}")
-  if response.status_code == 200:
-    df = pd.DataFrame(response.json())
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    df["user_id"] = user_id
-    return df
-  else:
-    print(f"Failed to fetch data for user {user_id}")
-    return pd.DataFrame()
-
-async def fetch_customers(client):
-  """Fetch customer data to identify consumers."""
-  response = await client.get(f"{BASE_URL}/customers/")
-  if response.status_code == 200:
-    return response.json()
-  else:
-    print("Failed to fetch customer data")
-    return []
+from api_client import EnergyTrackerClient
 
 async def main():
-  async with httpx.AsyncClient() as client:
+  async with EnergyTrackerClient() as api:
     # Fetch customers and identify consumers
-    customers = await fetch_customers(client)
+    customers = await api.get_customers()
     consumer_ids = [c["id"] for c in customers if c["is_consumer"]]
 
-    # Fetch consumption data for consumers
-    tasks = [fetch_user_data(client, user_id) for user_id in consumer_ids]
-    user_data_list = await asyncio.gather(*tasks)
-
-    # Combine all users' data into one DataFrame
-    energy_data = pd.concat(user_data_list, ignore_index=True)
+    # Fetch consumption data for consumers, combined into one DataFrame
+    energy_data = await api.get_consumption_production_many(consumer_ids)
     if energy_data.empty:
       print("Error: No energy data available.")
       return
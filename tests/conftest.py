@@ -0,0 +1,4 @@
+import os
+
+# app.database builds its engine at import, it only connects on first use
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://localhost/test")
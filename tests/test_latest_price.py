@@ -0,0 +1,74 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+import fakeredis
+import pytest
+from app.latest_price import LATEST_PRICE_KEY, get_latest_price_entry, set_latest_price
+from app.models import SIPXPrice
+
+REQUESTS = 10000
+
+# a session stand-in that counts queries and returns a fixed latest row
+class CountingSession:
+  def __init__(self, latest=None):
+    self.queries = 0
+    self.latest = latest
+
+  async def execute(self, query):
+    self.queries += 1
+    latest = self.latest
+
+    class Result:
+      def scalars(self):
+        return self
+
+      def first(self):
+        return latest
+
+    return Result()
+
+def price(id, hour, value):
+  return SIPXPrice(id=id, timestamp=datetime(2024, 1, 1, hour, tzinfo=timezone.utc), price_EUR_kWh=value)
+
+@pytest.fixture
+def redis():
+  return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+def test_pointer_hits_never_query_the_database(redis):
+  set_latest_price(redis, price(1, 5, 0.12))
+  db = CountingSession()
+
+  async def main():
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+      entry = await get_latest_price_entry(redis, db)
+    return entry, REQUESTS / (time.perf_counter() - started)
+
+  entry, per_second = asyncio.run(main())
+  print(f"{per_second:.0f} latest price lookups per second")
+  assert entry["price_EUR_kWh"] == 0.12
+  assert db.queries == 0
+  # even the in-process fake Redis serves thousands per second, a real one is faster
+  assert per_second > 1000
+
+def test_missing_pointer_is_rebuilt_with_one_query(redis):
+  db = CountingSession(latest=price(2, 6, 0.2))
+
+  async def main():
+    first = await get_latest_price_entry(redis, db)
+    second = await get_latest_price_entry(redis, db)
+    return first, second
+
+  first, second = asyncio.run(main())
+  assert first.price_EUR_kWh == 0.2
+  assert second["price_EUR_kWh"] == 0.2
+  assert db.queries == 1
+
+def test_pointer_only_moves_forward(redis):
+  set_latest_price(redis, price(3, 7, 0.3))
+  set_latest_price(redis, price(4, 6, 0.4))  # older entry written later
+  assert asyncio.run(get_latest_price_entry(redis, CountingSession()))["id"] == 3
+
+  set_latest_price(redis, price(3, 7, 0.35))  # the current entry itself is rewritten
+  assert asyncio.run(get_latest_price_entry(redis, CountingSession()))["price_EUR_kWh"] == 0.35
+  assert redis.exists(LATEST_PRICE_KEY)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+import fakeredis
+import pytest
+import app.single_flight as single_flight
+
+CONCURRENT_REQUESTS = 500
+
+# a database stand-in that counts its queries
+class CountingLoader:
+  def __init__(self, delay=0.05, error=None):
+    self.calls = 0
+    self.delay = delay
+    self.error = error
+
+  async def __call__(self):
+    self.calls += 1
+    await asyncio.sleep(self.delay)
+    if self.error is not None:
+      raise self.error
+    return f"value {self.calls}".encode()
+
+@pytest.fixture
+def redis():
+  return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+@pytest.fixture(autouse=True)
+def no_early_refresh(monkeypatch):
+  # early refresh is random, turn it off so query counts are exact
+  monkeypatch.setattr(single_flight, "EARLY_REFRESH_BETA", 0.0)
+
+async def request_many(redis, key, load, count=CONCURRENT_REQUESTS):
+  return await asyncio.gather(*(single_flight.get_or_load(redis, key, 60, load) for _ in range(count)))
+
+def test_concurrent_misses_query_once_per_key(redis):
+  load = CountingLoader()
+
+  async def main():
+    return await asyncio.gather(request_many(redis, "prices", load), request_many(redis, "customers", load))
+
+  prices, customers = asyncio.run(main())
+  assert load.calls == 2
+  assert len(set(prices)) == 1 and len(set(customers)) == 1
+
+def test_concurrent_misses_query_once_per_expiry(redis):
+  load = CountingLoader()
+  asyncio.run(request_many(redis, "prices", load))
+  asyncio.run(request_many(redis, "prices", load))
+  assert load.calls == 1
+
+  redis.delete("prices")  # the entry expired
+  values = asyncio.run(request_many(redis, "prices", load))
+  assert load.calls == 2
+  assert set(values) == {b"value 2"}
+
+def test_workers_share_one_query_through_the_lock(redis):
+  load = CountingLoader()
+
+  # each call stands for a different worker process, so the in-process coalescing is skipped
+  async def main():
+    return await asyncio.gather(*(single_flight.refresh(redis, "prices", 60, load, None) for _ in range(20)))
+
+  values = asyncio.run(main())
+  assert load.calls == 1
+  assert set(values) == {b"value 1"}
+
+def test_waiting_workers_take_over_when_the_holder_fails(redis):
+  failing = CountingLoader(delay=0.1, error=LookupError("not found"))
+  load = CountingLoader()
+
+  async def main():
+    holder = asyncio.ensure_future(single_flight.refresh(redis, "prices", 60, failing, None))
+    await asyncio.sleep(0.01)
+    started = time.monotonic()
+    value = await single_flight.refresh(redis, "prices", 60, load, None)
+    with pytest.raises(LookupError):
+      await holder
+    return value, time.monotonic() - started
+
+  value, waited = asyncio.run(main())
+  assert value == b"value 1"
+  assert load.calls == 1
+  assert waited < single_flight.LOCK_TIMEOUT / 10